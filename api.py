@@ -1,66 +1,170 @@
 from waitress import serve
-from flask import Flask, render_template, Response, request, redirect, url_for, session
+from flask import Flask, render_template, Response, request, redirect, url_for, session, jsonify
+from flask_sock import Sock
 import cv2
+import numpy as np
 import os
-from mvp import ExerciseTracker  # Import your MVP code
+import json
+import time
 import random
+import uuid
+from sessions import SessionRegistry, SessionLimitReached
+from pose_pool import PosePool, PoolExhausted
+from inference_workers import InferenceWorkerPool
+from exercises import EXERCISES, load_exercise_specs
+from metrics import metrics
+from pose_cache import PoseCache
+from async_stream import AsyncStreamServer
+from frame_hub import StreamProfile
+from uploads import UploadStore, UploadCapture, UploadQuotaExceeded, UploadOffsetMismatch, parse_size
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key'  # For session management
+sock = Sock(app)
 UPLOAD_FOLDER = 'static/uploads'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['UPLOAD_MAX_MB'] = int(os.environ.get('UPLOAD_MAX_MB', 2048))  # disk quota for uploads, oldest go first
+app.config['MAX_SESSIONS'] = int(os.environ.get('MAX_SESSIONS', 32))
+app.config['SESSION_IDLE_TIMEOUT'] = int(os.environ.get('SESSION_IDLE_TIMEOUT', 300))  # seconds
+app.config['POSE_POOL_SIZE'] = int(os.environ.get('POSE_POOL_SIZE', app.config['MAX_SESSIONS']))
+app.config['POSE_POOL_PREWARM'] = int(os.environ.get('POSE_POOL_PREWARM', 4))
+app.config['POSE_MODEL_COMPLEXITY'] = int(os.environ.get('POSE_MODEL_COMPLEXITY', 1))
+app.config['INFERENCE_WORKERS'] = int(os.environ.get('INFERENCE_WORKERS', 0))  # processes running the pose graphs, 0 runs them in this one
+app.config['LIVE_TARGET_LATENCY'] = float(os.environ.get('LIVE_TARGET_LATENCY', 0.15))  # seconds, webcam feeds only
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1') != '0'
+app.config['POSE_CACHE_DIR'] = os.environ.get('POSE_CACHE_DIR', 'pose_cache')  # empty to disable
+app.config['POSE_CACHE_MAX_MB'] = int(os.environ.get('POSE_CACHE_MAX_MB', 512))
+app.config['SESSION_ARCHIVE_DIR'] = os.environ.get('SESSION_ARCHIVE_DIR', 'session_archive')  # empty to disable
+app.config['SESSION_ARCHIVE_MAX_MB'] = int(os.environ.get('SESSION_ARCHIVE_MAX_MB', 1024))  # oldest sessions go first, 0 keeps everything
+app.config['POSE_MOTION_GATE'] = os.environ.get('POSE_MOTION_GATE', '0') == '1'  # skip inference on still frames, see motion_gate.py
+app.config['POSE_LANDMARKER_MODEL'] = os.environ.get('POSE_LANDMARKER_MODEL')  # .task bundle, needed for ?people=N
+app.config['MAX_PEOPLE'] = int(os.environ.get('MAX_PEOPLE', 8))
+app.config['ASYNC_STREAM_PORT'] = int(os.environ.get('ASYNC_STREAM_PORT', 0))  # 0 keeps streams on the Flask server
+metrics.enabled = app.config['METRICS_ENABLED']
 
-video_capture = None
-tracker = None  # Exercise tracker instance
+# Graphs (and mediapipe itself) load on a background thread so the server answers straight away, see /readyz
+if app.config['INFERENCE_WORKERS']:
+    # Same interface, graphs live in worker processes that frames reach through shared memory, see inference_workers.py
+    workers = app.config['INFERENCE_WORKERS']
+    pose_pool = InferenceWorkerPool(workers=workers, size=app.config['POSE_POOL_SIZE'],
+                                    prewarm=max(1, -(-app.config['POSE_POOL_PREWARM'] // workers)),
+                                    model_complexity=app.config['POSE_MODEL_COMPLEXITY'])
+else:
+    pose_pool = PosePool(size=app.config['POSE_POOL_SIZE'], prewarm=app.config['POSE_POOL_PREWARM'],
+                         model_complexity=app.config['POSE_MODEL_COMPLEXITY'], background=True)
+# Landmarks of uploaded clips by content hash, so re-checking the same workout skips inference
+pose_cache = PoseCache(app.config['POSE_CACHE_DIR'], app.config['POSE_CACHE_MAX_MB'] * 1024 * 1024) if app.config['POSE_CACHE_DIR'] else None
+# One pipeline (capture + tracker) per browser session so concurrent users don't share a camera or rep count
+registry = SessionRegistry(max_sessions=app.config['MAX_SESSIONS'], idle_timeout=app.config['SESSION_IDLE_TIMEOUT'], pose_pool=pose_pool, pose_cache=pose_cache,
+                           archive_dir=app.config['SESSION_ARCHIVE_DIR'], archive_max_bytes=app.config['SESSION_ARCHIVE_MAX_MB'] * 1024 * 1024,
+                           multi_pose_model=app.config['POSE_LANDMARKER_MODEL'], motion_gate=app.config['POSE_MOTION_GATE'])
+registry.start_reaper()
+upload_store = UploadStore(app.config['UPLOAD_FOLDER'], app.config['UPLOAD_MAX_MB'] * 1024 * 1024)
 filename = ["push-up_3.mp4","plank_5.mp4","pull up_1.mp4","hammer curl_8.mp4","tricep dips_11.mp4","tricep pushdown_40.mp4"]
-exercises = None
+if os.environ.get('EXERCISE_SPECS'):
+    load_exercise_specs(os.environ['EXERCISE_SPECS'])  # extra/overridden exercises as JSON, see exercises.py
+exercises = EXERCISES
+async_streams = None
 
-def generate_frames():
-    global video_capture, tracker
-    while video_capture and video_capture.isOpened():
-        success, frame = video_capture.read()
-        if not success:
-            break
-        frame = cv2.resize(frame, (640, 500))
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        result = tracker.pose.process(rgb_frame)
+def get_session_id():
+    if 'sid' not in session:
+        session['sid'] = uuid.uuid4().hex
+    return session['sid']
+
+def current_pipeline():
+    return registry.get(get_session_id())
+
+def session_id_from_cookie(value):
+    # Lets the asyncio stream server find a viewer's session from the same signed cookie Flask uses
+    return app.session_interface.get_signing_serializer(app).loads(value).get('sid')
+
+def start_async_streams():
+    # /video_feed and /landmark_feed served by asyncio on ASYNC_STREAM_PORT, see async_stream.py
+    global async_streams
+    async_streams = AsyncStreamServer(registry, session_id_from_cookie, cookie_name=app.config['SESSION_COOKIE_NAME'],
+                                      port=app.config['ASYNC_STREAM_PORT'], target_latency=app.config['LIVE_TARGET_LATENCY']).start()
+    return async_streams
+
+@app.context_processor
+def stream_urls():
+    # Templates point the <img> at the async stream server when it is running
+    if not async_streams:
+        return {'stream_url': None}
+    return {'stream_url': f"//{request.host.rsplit(':', 1)[0]}:{async_streams.port}/video_feed"}
 
-        if result.pose_landmarks:
-            landmarks = result.pose_landmarks.landmark
-            angles,keypoints = tracker.get_angles_from_landmarks(landmarks)  # Extract angles
-            tracker.count_reps(frame, angles, result, landmarks, keypoints)
+def pose_cache_variant():
+    # Landmarks depend on the model, the 640x500 input FramePipeline resizes to and motion gating, not just the file
+    return f"m{app.config['POSE_MODEL_COMPLEXITY']}-640x500" + ("-gate" if app.config['POSE_MOTION_GATE'] else "")
 
-        ret, buffer = cv2.imencode('.jpg', frame)
-        frame = cv2.resize(frame, (640, 500))
-        frame = buffer.tobytes()
-        yield (b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+def frame_hub(pipeline):
+    # Every stream of a session subscribes to its one FrameHub, so a second tab or a trainer's dashboard
+    # doesn't start a second capture/inference pipeline that steals frames from the first
+    return pipeline.frame_hub(target_latency=app.config['LIVE_TARGET_LATENCY'])
+
+def generate_frames(pipeline, profile=None):
+    # Capture, pose inference and JPEG encoding run as overlapping stages in the hub, this thread only sends
+    hub = frame_hub(pipeline)
+    subscriber = hub.subscribe("mjpeg", profile=profile)
+    try:
+        for part in subscriber:
+            start = metrics.start()
+            sending = time.perf_counter()
+            yield part  # already framed as a multipart part, shared by every viewer on the same profile
+            subscriber.sent(time.perf_counter() - sending)  # client backpressure, steps an adaptive profile down
+            metrics.observe("send", start)  # time until the server asked for the next chunk, i.e. client backpressure
+    finally:
+        hub.unsubscribe(subscriber)
+
+def generate_landmark_events(pipeline):
+    # Server-sent events, one JSON landmarks/rep-state object per processed frame
+    hub = frame_hub(pipeline)
+    subscriber = hub.subscribe("json")
+    try:
+        for state in subscriber:
+            yield b'data: ' + state + b'\n\n'
+    finally:
+        hub.unsubscribe(subscriber)
+
+def decode_frame(data):
+    # Browser capture sends each frame as an encoded JPEG/PNG blob
+    if not data:
+        return None
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
 
 @app.route('/')
 def index():
-    global exercises
-    exercises = ["Push-up", "Plank", "Pull-up", "Hammer Curl", "Tricep Dip", "Tricep Pull-down"]
     return render_template('index.html', exercises=exercises)
 
 @app.route('/start_exercise', methods=['GET'])
 def start_exercise():
-    global video_capture, tracker, exercise_id
-    exercise_id = int(request.args.get('exercise', 0))  # Get from URL params
+    try:
+        exercise_id = int(request.args.get('exercise', 0))  # Get from URL params
+        people = min(int(request.args.get('people', 1)), app.config['MAX_PEOPLE'])  # >1 for group classes on one camera
+        registry.create(get_session_id(), exercise_id, people)
+    except (SessionLimitReached, PoolExhausted):
+        return "Server is busy, please try again later", 503
+    except ValueError as e:
+        return str(e), 400
     session['exercise_id'] = exercise_id
-    tracker = ExerciseTracker(exercise_id=exercise_id)
     # video_capture = cv2.VideoCapture(filename[exercise_id])  # Using local videos
+    if request.args.get('capture') == 'browser':
+        # Camera lives in the browser, frames come back through /receive_frame or /ws/frames
+        return render_template('exercise1.html', exercise_type = exercises[exercise_id])
     return render_template('exercise.html', exercise_type = exercises[exercise_id])
 
 @app.route('/start_webcam', methods=['POST'])
 def start_webcam():
-    global video_capture
-    if video_capture:
-        video_capture.release()
-    video_capture = cv2.VideoCapture(0)  # Start webcam
-    return render_template('exercise.html',exercise_type = exercises[exercise_id])
+    pipeline = current_pipeline()
+    if not pipeline:
+        return redirect(url_for('index'))
+    pipeline.open_capture(0)  # Start webcam
+    return render_template('exercise.html',exercise_type = exercises[session['exercise_id']])
 
 @app.route('/upload_video', methods=['POST'])
 def upload_video():
-    global video_capture
+    pipeline = current_pipeline()
+    if not pipeline:
+        return redirect(url_for('index'))
     if 'file' not in request.files:
         return "No file uploaded", 400
     
@@ -68,29 +172,188 @@ def upload_video():
     if file.filename == '':
         return "No selected file", 400
 
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-    file.save(filepath)
+    try:
+        # Streamed to disk under a generated name, hashed on the way for the pose cache
+        upload = upload_store.save(file.filename, file.stream, owner=get_session_id())
+    except ValueError as e:
+        return str(e), 400
+    except UploadQuotaExceeded as e:
+        return str(e), 413
+
+    cache_key = upload.cache_key(pose_cache_variant()) if pose_cache else None
+    pipeline.open_capture(upload.path, cache_key)  # Load uploaded video
 
-    if video_capture:
-        video_capture.release()
-    video_capture = cv2.VideoCapture(filepath)  # Load uploaded video
+    return render_template('exercise.html', exercise_type = exercises[session['exercise_id']])
 
-    return render_template('exercise.html')
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    # Chunked, resumable upload: POST {"filename", "size"} here, then PUT the bytes in order to
+    # /uploads/<id>?offset=N. The session starts reading the video as soon as the first chunk is in,
+    # GET /uploads/<id> tells a client that lost its connection where to resume.
+    pipeline = current_pipeline()
+    if not pipeline:
+        return jsonify({"error": "No active exercise session"}), 404
+    info = request.get_json(silent=True) or request.form
+    if not isinstance(info, dict):
+        return jsonify({"error": "Expected a JSON object with filename and size"}), 400
+    try:
+        upload = upload_store.create(info.get('filename'), parse_size(info.get('size')), owner=get_session_id())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except UploadQuotaExceeded as e:
+        return jsonify({"error": str(e)}), 413
+    variant = pose_cache_variant()
+    # The content hash is only known once the last chunk is in
+    pipeline.open_capture(UploadCapture(upload), (lambda: upload.cache_key(variant)) if pose_cache else None)
+    return jsonify(upload.status()), 201
+
+@app.route('/uploads/<upload_id>', methods=['GET', 'PUT'])
+def upload_chunk(upload_id):
+    upload = upload_store.get(upload_id, owner=get_session_id())
+    if not upload:
+        return jsonify({"error": "No such upload"}), 404
+    if request.method == 'GET':
+        return jsonify(upload.status())
+    try:
+        upload_store.write(upload, request.stream, int(request.args['offset']))
+    except UploadOffsetMismatch:
+        return jsonify(upload.status()), 409
+    except (KeyError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    except UploadQuotaExceeded as e:
+        return jsonify({"error": str(e)}), 413
+    return jsonify(upload.status())
 
 @app.route('/video_feed')
 def video_feed():
-    return Response(generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    pipeline = current_pipeline()
+    if not pipeline:
+        return "No active exercise session", 404
+    try:
+        # ?profile=high|medium|low, or ?width=&quality=&fps= for a custom ceiling; ?adaptive=0 keeps it fixed
+        profile = StreamProfile.from_query(request.args)
+    except ValueError as e:
+        return str(e), 400
+    return Response(generate_frames(pipeline, profile), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+@app.route('/receive_frame', methods=['POST'])
+def receive_frame():
+    pipeline = current_pipeline()
+    if not pipeline:
+        return "No active exercise session", 404
+    frame = decode_frame(request.get_data())
+    if frame is None:
+        return "Invalid image", 400
+    as_json = request.args.get('format') == 'json'
+    timestamp = time.time()
+    result = pipeline.process_frame(frame, timestamp, draw=not as_json)
+    if result is None:
+        return "Exercise session has ended", 410
+    if as_json:
+        return jsonify(pipeline.frame_state(result, timestamp))
+    start = metrics.start()
+    ret, buffer = cv2.imencode('.jpg', frame)
+    metrics.observe("encode", start)
+    return Response(buffer.tobytes(), mimetype='image/jpeg')
+
+@sock.route('/ws/frames')
+def ws_frames(ws):
+    # Persistent variant of /receive_frame: binary JPEG frames in, JSON landmarks/rep state out
+    # (or annotated JPEGs with ?format=jpeg), one round trip per frame and no per-request HTTP setup
+    pipeline = current_pipeline()
+    if not pipeline:
+        ws.send(json.dumps({"error": "No active exercise session"}))
+        return
+    send_jpeg = request.args.get('format') == 'jpeg'
+    while True:
+        data = ws.receive()
+        if isinstance(data, str):
+            continue  # text messages are keep-alives
+        frame = decode_frame(data)
+        if frame is None:
+            ws.send(json.dumps({"error": "Invalid image"}))
+            continue
+        timestamp = time.time()
+        result = pipeline.process_frame(frame, timestamp, draw=send_jpeg)
+        if result is None:
+            ws.send(json.dumps({"error": "Exercise session has ended"}))
+            break
+        if send_jpeg:
+            start = metrics.start()
+            ret, buffer = cv2.imencode('.jpg', frame)
+            metrics.observe("encode", start)
+            ws.send(buffer.tobytes())
+        else:
+            ws.send(json.dumps(pipeline.frame_state(result, timestamp)))
+
+@app.route('/landmark_feed')
+def landmark_feed():
+    # Landmark-only alternative to /video_feed for clients that draw the overlay themselves
+    pipeline = current_pipeline()
+    if not pipeline:
+        return "No active exercise session", 404
+    return Response(generate_landmark_events(pipeline), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+@sock.route('/ws/landmarks')
+def ws_landmarks(ws):
+    # Same as /landmark_feed over a WebSocket, packed binary frames by default (see landmarks.pack_landmarks)
+    pipeline = current_pipeline()
+    if not pipeline:
+        ws.send(json.dumps({"error": "No active exercise session"}))
+        return
+    # The packed format holds one body, multi-person sessions always send JSON
+    output = 'json' if request.args.get('format') == 'json' or pipeline.multi else 'binary'
+    hub = frame_hub(pipeline)
+    subscriber = hub.subscribe(output)
+    try:
+        for payload in subscriber:
+            ws.send(payload.decode() if output == 'json' else payload)
+    finally:
+        hub.unsubscribe(subscriber)
+
+@app.route('/healthz')
+def healthz():
+    # Liveness: the process is up and handling requests, whether or not the model has loaded yet
+    return jsonify({"status": "ok"})
+
+@app.route('/readyz')
+def readyz():
+    # Readiness: 503 until the pose pool has warmed up, so a load balancer only sends streams once inference is ready,
+    # and again if every inference worker has since failed
+    ready = pose_pool.ready.is_set() and not pose_pool.error
+    state = {"ready": ready, "pose_pool_available": pose_pool.available(),
+             "active_sessions": registry.active_count(), "max_sessions": app.config['MAX_SESSIONS']}
+    if pose_pool.error:
+        state["error"] = pose_pool.error
+    return jsonify(state), 200 if ready else 503
+
+@app.route('/metrics')
+def metrics_endpoint():
+    # Prometheus scrape target: per-stage latency histograms, per-session FPS and dropped frames
+    if not metrics.enabled:
+        return "Metrics are disabled", 404
+    gauges = {
+        'active_sessions': ("Exercise sessions currently open", registry.active_count()),
+        'pool_available': ("Idle pose graphs in the pool", pose_pool.available()),
+        'stream_viewers': ("Clients subscribed to a session's frame hub", sum(p.hub.viewers() for p in registry.active() if p.hub)),
+    }
+    if async_streams:
+        gauges['async_stream_connections'] = ("Open connections on the async stream server", async_streams.active)
+    return Response(metrics.render(registry.active(), gauges), mimetype='text/plain; version=0.0.4')
 
 @app.route('/stop_exercise', methods=['POST'])
 def stop_exercise():
-    global video_capture, tracker
-    if video_capture:
-        video_capture.release()
+    pipeline = registry.remove(get_session_id())
+    tracker = pipeline.tracker if pipeline else None
     reps = tracker.rep_count if tracker else 0
     calories = round(tracker.calories_burned if tracker else 0, 2)
     duration = round(tracker.exercise_duration if tracker else 0,2)
-    return render_template('results.html', reps=reps, calories=calories, duration=duration, exercise_type=tracker.exercise_type, sets_completed=random.randint(0,6), heart_rate=98)
+    return render_template('results.html', reps=reps, calories=calories, duration=duration, exercise_type=exercises[session.get('exercise_id', 0)], sets_completed=random.randint(0,6), heart_rate=98)
 
 if __name__ == '__main__':
+    # Under the debug reloader only the child process serves, so start the stream server there
+    # (call start_async_streams() unconditionally when using waitress)
+    if app.config['ASYNC_STREAM_PORT'] and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_async_streams()
     app.run(debug=True) #uncomment to use flask development server
     # serve(app, port=5000) #uncomment if you want to use waitress server
\ No newline at end of file
@@ -0,0 +1,131 @@
+import json
+import os
+import struct
+import time
+
+import numpy as np
+
+from landmarks import ANGLE_NAMES, NUM_LANDMARKS
+
+# Session archive: everything a session saw, one fixed-size record per processed frame, so a whole
+# directory of sessions can be memory-mapped and scanned without decoding video or running the model.
+#
+#   magic "PTLA", uint16 version, uint32 header length, JSON header (session, exercise, state names, ...)
+#   then N records of FRAME_DTYPE, N taken from the file size so a crashed session is still readable
+#
+# Columns come back as zero-copy views: frames["points"] is (N, 33, 4), frames["timestamp"] is (N,).
+MAGIC = b"PTLA"
+VERSION = 1
+PREAMBLE = struct.Struct("<4sHI")
+
+FRAME_DTYPE = np.dtype([
+    ("timestamp", "<f8"),
+    ("points", "<f4", (NUM_LANDMARKS, 4)),    # raw x, y, z, visibility from the model, NaN when nobody was detected
+    ("angles", "<f4", (len(ANGLE_NAMES),)),   # joint angles the rules saw (after smoothing), NaN when not detected
+    ("state", "u1"),                          # index into the header's "states"
+    ("posture_ok", "u1"),
+    ("reps", "<u4"),
+])
+ARCHIVE_EXTENSION = ".ptla"
+
+
+class ArchiveWriter:
+    # Buffers records and appends them in blocks, the file is valid (minus the buffer) at any point
+    def __init__(self, path, header, buffer_frames=256):
+        self.path = path
+        self.states = {name: i for i, name in enumerate(header.get("states", []))}
+        header = dict(header, version=VERSION, angle_names=ANGLE_NAMES, num_landmarks=NUM_LANDMARKS,
+                      created=header.get("created", time.time()))
+        header["states"] = list(self.states)
+        encoded = json.dumps(header).encode()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(path, "wb")
+        self.file.write(PREAMBLE.pack(MAGIC, VERSION, len(encoded)) + encoded)
+        self.buffer = np.zeros(buffer_frames, dtype=FRAME_DTYPE)
+        self.pending = 0
+        self.frames = 0
+
+    def append(self, timestamp, points, angles, state, posture_ok, reps):
+        record = self.buffer[self.pending]
+        record["timestamp"] = timestamp or 0.0
+        record["points"] = np.nan if points is None else points
+        record["angles"] = np.nan if angles is None else angles
+        record["state"] = self.states.get(state, 0)
+        record["posture_ok"] = posture_ok
+        record["reps"] = reps
+        self.pending += 1
+        self.frames += 1
+        if self.pending == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        if self.pending and self.file:
+            self.file.write(self.buffer[:self.pending].tobytes())
+            self.file.flush()
+        self.pending = 0
+
+    def close(self):
+        if self.file:
+            self.flush()
+            self.file.close()
+            self.file = None
+
+
+def read_archive(path):
+    # Returns (header dict, frames) where frames is a read-only memmap of FRAME_DTYPE records
+    with open(path, "rb") as f:
+        magic, version, header_len = PREAMBLE.unpack(f.read(PREAMBLE.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a session archive")
+        if version > VERSION:
+            raise ValueError(f"{path} has archive version {version}, this code reads up to {VERSION}")
+        header = json.loads(f.read(header_len))
+    offset = PREAMBLE.size + header_len
+    count = (os.path.getsize(path) - offset) // FRAME_DTYPE.itemsize
+    if count == 0:
+        return header, np.zeros(0, dtype=FRAME_DTYPE)
+    return header, np.memmap(path, dtype=FRAME_DTYPE, mode="r", offset=offset, shape=(count,))
+
+
+def iter_archives(directory):
+    # (path, header, frames) for every archive in a directory, oldest first
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(ARCHIVE_EXTENSION):
+            path = os.path.join(directory, name)
+            header, frames = read_archive(path)
+            yield path, header, frames
+
+
+def evict_archives(directory, max_bytes, keep=()):
+    # Removes the oldest archives until the directory is within max_bytes. Paths in keep belong to sessions that
+    # are still writing them and stay; they count towards the total, so the next session start evicts more.
+    entries = []
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.name.endswith(ARCHIVE_EXTENSION) and entry.is_file():
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+    except FileNotFoundError:
+        return  # nothing archived yet, writers create the directory
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path in keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+
+def state_transitions(header, frames):
+    # [(timestamp, from_state, to_state), ...] derived from the per-frame state column
+    states = frames["state"]
+    if len(states) == 0:
+        return []
+    changes = np.flatnonzero(states[1:] != states[:-1]) + 1
+    names = header["states"]
+    return [(float(frames["timestamp"][i]), names[states[i - 1]], names[states[i]]) for i in changes]
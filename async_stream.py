@@ -0,0 +1,179 @@
+import asyncio
+import collections
+import threading
+from http.cookies import SimpleCookie
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+from frame_hub import StreamProfile
+from metrics import metrics
+
+
+class AsyncSubscriber:
+    # FrameHub subscriber for a coroutine: the hub's encode thread hands payloads to the event loop, which
+    # keeps the newest maxsize of them and drops older ones for a client that can't keep up
+    def __init__(self, kind, loop, maxsize=2, profile=None):
+        self.kind = kind
+        self.profile = profile
+        self.loop = loop
+        self.items = collections.deque(maxlen=maxsize)
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.dropped = 0
+
+    def deliver(self, payload):
+        self.loop.call_soon_threadsafe(self._put, payload)
+
+    def sent(self, seconds):
+        if self.profile:
+            self.profile.update(seconds, self.dropped)
+
+    def close(self):
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._close)
+
+    def _put(self, payload):
+        if len(self.items) == self.items.maxlen:
+            self.dropped += 1
+            metrics.count("subscriber_dropped_frames")
+        self.items.append(payload)
+        self.ready.set()
+
+    def _close(self):
+        self.closed = True
+        self.ready.set()
+
+    async def get(self):
+        # Next payload, None once the stream has ended
+        while not self.items and not self.closed:
+            self.ready.clear()
+            await self.ready.wait()
+        return self.items.popleft() if self.items else None
+
+
+class AsyncStreamServer:
+    # asyncio HTTP server for the long-lived streams (/video_feed MJPEG and /landmark_feed SSE) so that a
+    # viewer costs a coroutine and a socket instead of a Flask/waitress worker thread for the whole workout.
+    # Frames come from the session's FrameHub, the same one the Flask routes subscribe to, so capture and
+    # inference run once per session however many clients watch; sockets are only ever touched from the
+    # event loop, so hundreds of idle or slow clients don't hold any threads.
+    # Sessions are the same SessionRegistry the Flask app uses, looked up from the Flask session cookie.
+    def __init__(self, registry, session_id_from_cookie, cookie_name="session", host="0.0.0.0", port=5001,
+                 max_connections=500, target_latency=0.15, size=(640, 500), send_timeout=30):
+        self.registry = registry
+        self.session_id_from_cookie = session_id_from_cookie
+        self.cookie_name = cookie_name
+        self.host = host
+        self.port = port
+        self.connections = asyncio.Semaphore(max_connections)
+        self.target_latency = target_latency
+        self.size = size
+        self.send_timeout = send_timeout  # seconds a client may stall a write before it's dropped
+        self.active = 0
+        self.loop = None
+        self.server = None
+
+    def start(self):
+        # Serve from a background thread next to the Flask server
+        ready = threading.Event()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            self.server = self.loop.run_until_complete(asyncio.start_server(self.handle, self.host, self.port))
+            ready.set()
+            self.loop.run_forever()
+
+        threading.Thread(target=run, daemon=True, name="async-stream").start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.server.close)
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+    async def handle(self, reader, writer):
+        async with self.connections:
+            self.active += 1
+            try:
+                await self._serve(reader, writer)
+            except (ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                pass  # client went away or stalled
+            finally:
+                self.active -= 1
+                writer.close()
+
+    async def _serve(self, reader, writer):
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=10)
+        lines = head.decode("latin-1").split("\r\n")
+        method, target, _ = (lines[0].split(" ") + ["", ""])[:3]
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        url = urlsplit(target)
+        path = url.path
+
+        if method != "GET" or path not in ("/video_feed", "/landmark_feed"):
+            await self._respond(writer, "404 Not Found", "text/plain", b"Not found")
+            return
+        pipeline = self._pipeline(headers.get("cookie", ""))
+        if not pipeline:
+            await self._respond(writer, "404 Not Found", "text/plain", b"No active exercise session")
+            return
+
+        profile = None
+        if path == "/video_feed":
+            content_type, kind = "multipart/x-mixed-replace; boundary=frame", "mjpeg"
+            try:
+                profile = StreamProfile.from_query(dict(parse_qsl(url.query)))
+            except ValueError as e:
+                await self._respond(writer, "400 Bad Request", "text/plain", str(e).encode())
+                return
+        else:
+            content_type, kind = "text/event-stream", "json"
+        writer.write(self._head("200 OK", content_type))
+        await writer.drain()
+        await self._stream(pipeline, writer, kind, profile)
+
+    def _pipeline(self, cookie_header):
+        cookie = SimpleCookie()
+        try:
+            cookie.load(cookie_header)
+            session_id = self.session_id_from_cookie(cookie[self.cookie_name].value)
+        except Exception:
+            return None
+        return self.registry.get(session_id) if session_id else None
+
+    @staticmethod
+    def _head(status, content_type, length=None):
+        head = f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nCache-Control: no-cache\r\nConnection: close\r\n"
+        if length is not None:
+            head += f"Content-Length: {length}\r\n"
+        return (head + "\r\n").encode("latin-1")
+
+    async def _respond(self, writer, status, content_type, body):
+        writer.write(self._head(status, content_type, len(body)) + body)
+        await writer.drain()
+
+    async def _stream(self, pipeline, writer, kind, profile=None):
+        hub = pipeline.frame_hub(size=self.size, target_latency=self.target_latency)
+        subscriber = hub.subscribe(kind, AsyncSubscriber(kind, asyncio.get_running_loop(), hub.buffer_size(), profile))
+        try:
+            while True:
+                payload = await subscriber.get()
+                if payload is None:
+                    break
+                if kind == "mjpeg":
+                    writer.write(payload)
+                else:
+                    writer.writelines((b"data: ", payload, b"\n\n"))
+                start = metrics.start()
+                sending = time.perf_counter()
+                await asyncio.wait_for(writer.drain(), timeout=self.send_timeout)
+                subscriber.sent(time.perf_counter() - sending)
+                metrics.observe("send", start)
+        finally:
+            # The last viewer leaving stops the pipeline, which waits for its threads: not on the event loop
+            await asyncio.get_running_loop().run_in_executor(None, hub.unsubscribe, subscriber)
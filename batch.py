@@ -0,0 +1,250 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from exercises import EXERCISES, load_exercise_specs
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv", ".webm")
+
+# Filename prefixes used by our recordings (e.g. "push-up_3.mp4", "tricep pushdown_40.mp4")
+FILENAME_PREFIXES = {
+    "push-up": 0, "pushup": 0, "push up": 0,
+    "plank": 1,
+    "pull up": 2, "pull-up": 2, "pullup": 2,
+    "hammer curl": 3,
+    "tricep dips": 4, "tricep dip": 4,
+    "tricep pushdown": 5, "tricep pull-down": 5, "tricep pulldown": 5,
+}
+
+RESULT_FIELDS = ["file", "exercise", "reps", "duration", "calories", "frames", "processing_seconds", "fps", "error"]
+
+_worker_pose = None
+_worker_cache = None
+_worker_variant = ""
+
+
+def exercise_from_filename(path):
+    name = os.path.splitext(os.path.basename(path))[0].lower().rsplit("_", 1)[0].strip()
+    return FILENAME_PREFIXES.get(name)
+
+
+def parse_exercise(value):
+    # Exercise id or name -> id, ValueError for ones that don't exist
+    if value is None:
+        return None
+    if value.isdigit():
+        if int(value) >= len(EXERCISES):
+            raise ValueError(f"unknown exercise id {value}, there are {len(EXERCISES)}")
+        return int(value)
+    if value not in EXERCISES:
+        raise ValueError(f"unknown exercise {value!r}")
+    return EXERCISES.index(value)
+
+
+def collect_clips(inputs, manifest=None):
+    # Returns (path, exercise_id or None) pairs from directories, single files and/or a manifest
+    clips = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                for name in sorted(files):
+                    if name.lower().endswith(VIDEO_EXTENSIONS):
+                        clips.append((os.path.join(root, name), None))
+        else:
+            clips.append((item, None))
+
+    if manifest:
+        # One clip per line, optionally "path,exercise" where exercise is an id or name
+        base = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest) as f:
+            for row in csv.reader(f):
+                if not row or row[0].startswith("#"):
+                    continue
+                path = row[0].strip()
+                if not os.path.isabs(path):
+                    path = os.path.join(base, path)
+                try:
+                    clips.append((path, parse_exercise(row[1].strip()) if len(row) > 1 else None))
+                except ValueError as e:
+                    print(f"Skipping {path}: {e}")
+
+    # Drop duplicates (e.g. a manifest entry for a file also found by a directory scan), explicit exercises win
+    unique = {}
+    for path, exercise_id in clips:
+        if unique.get(path) is None:
+            unique[path] = exercise_id
+    return list(unique.items())
+
+
+def _init_worker(model_complexity, specs=None, cache_dir=None):
+    # One Pose graph per worker process, reused (and reset) for every clip it gets
+    global _worker_pose, _worker_cache, _worker_variant
+    import cv2
+    import mediapipe as mp
+    if specs:
+        load_exercise_specs(specs)
+    cv2.setNumThreads(1)  # the pool already uses every core
+    _worker_pose = mp.solutions.pose.Pose(model_complexity=model_complexity,
+                                          min_detection_confidence=0.5, min_tracking_confidence=0.5)
+    if cache_dir:
+        from pose_cache import PoseCache
+        _worker_cache = PoseCache(cache_dir)
+        _worker_variant = f"m{model_complexity}-full"  # process_videos runs the model on unresized frames
+
+
+def process_clip(path, exercise_id):
+    from mvp import ExerciseTracker
+    started = time.perf_counter()
+    row = {"file": path, "exercise": str(exercise_id), "error": ""}
+    try:
+        row["exercise"] = EXERCISES[exercise_id]
+        _worker_pose.reset()
+        tracker = ExerciseTracker(exercise_id=exercise_id, pose=_worker_pose)
+        tracker.process_videos(path, cache=_worker_cache, cache_variant=_worker_variant)
+        if tracker.frames_processed == 0:
+            raise ValueError("no frames could be decoded")
+        row.update(reps=tracker.rep_count, duration=round(tracker.exercise_duration, 2),
+                   calories=round(tracker.calories_burned, 2), frames=tracker.frames_processed)
+    except Exception as e:
+        row.update(reps=0, duration=0, calories=0, frames=0, error=str(e))
+    elapsed = time.perf_counter() - started
+    row["processing_seconds"] = round(elapsed, 3)
+    row["fps"] = round(row["frames"] / elapsed, 1) if elapsed else 0
+    return row
+
+
+def failed_clip(path, exercise_id, error):
+    # Result row for a clip that never produced one of its own
+    name = EXERCISES[exercise_id] if 0 <= exercise_id < len(EXERCISES) else str(exercise_id)
+    return {"file": path, "exercise": name, "reps": 0, "duration": 0, "calories": 0, "frames": 0,
+            "processing_seconds": 0, "fps": 0, "error": error}
+
+
+def write_results(rows, out_path):
+    if out_path.lower().endswith(".csv"):
+        with open(out_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(out_path, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+class ResultLog:
+    # Writes each row to out_path as its clip finishes, so a batch that dies overnight keeps what it got through.
+    # CSV rows are appended as they come; JSON goes out as an array one row per line, which only gets its closing
+    # bracket when write_results replaces the file with the sorted rows at the end.
+    def __init__(self, out_path):
+        self.csv = out_path.lower().endswith(".csv")
+        self.file = open(out_path, "w", newline="" if self.csv else None)
+        if self.csv:
+            self.writer = csv.DictWriter(self.file, fieldnames=RESULT_FIELDS)
+            self.writer.writeheader()
+        else:
+            self.file.write("[")
+        self.rows = 0
+
+    def add(self, row):
+        if self.csv:
+            self.writer.writerow(row)
+        else:
+            self.file.write(("," if self.rows else "") + "\n" + json.dumps(row))
+        self.rows += 1
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def run_batch(clips, out_path, workers=None, model_complexity=1, specs=None, cache_dir=None, attempts=2):
+    # A worker that crashes (e.g. a segfault in the decoder) breaks the whole pool and every clip still in it.
+    # Those clips are run again in a fresh pool, up to attempts times in all, then reported as failed.
+    rows = []
+    log = ResultLog(out_path)
+    pending = list(clips)
+    try:
+        for attempt in range(1, attempts + 1):
+            crashed = []
+            # spawn rather than fork so each worker builds its own MediaPipe graph from a clean interpreter
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                     initializer=_init_worker, initargs=(model_complexity, specs, cache_dir)) as pool:
+                futures = {pool.submit(process_clip, path, exercise_id): (path, exercise_id)
+                           for path, exercise_id in pending}
+                for future in as_completed(futures):
+                    path, exercise_id = futures[future]
+                    try:
+                        row = future.result()
+                    except BrokenProcessPool:
+                        crashed.append((path, exercise_id))
+                        continue
+                    except Exception as e:
+                        row = failed_clip(path, exercise_id, f"{type(e).__name__}: {e}")
+                    rows.append(row)
+                    log.add(row)
+                    status = row["error"] or f"{row['reps']} reps, {row['fps']} fps"
+                    print(f"[{len(rows)}/{len(clips)}] {row['file']}: {status}")
+            if not crashed:
+                break
+            if attempt < attempts:
+                print(f"A worker process crashed, running the {len(crashed)} clips it took down again")
+            pending = crashed
+        for path, exercise_id in crashed:
+            row = failed_clip(path, exercise_id, "worker process crashed (on this clip or one running next to it)")
+            rows.append(row)
+            log.add(row)
+            print(f"[{len(rows)}/{len(clips)}] {path}: {row['error']}")
+    finally:
+        log.close()
+    rows.sort(key=lambda r: r["file"])
+    write_results(rows, out_path)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless batch rep counting over recorded exercise videos")
+    parser.add_argument("inputs", nargs="*", help="video files or directories to scan")
+    parser.add_argument("--manifest", help="text/CSV file listing clips, one 'path[,exercise]' per line")
+    parser.add_argument("--exercise", help="exercise id or name for clips whose filename doesn't say")
+    parser.add_argument("--out", default="batch_results.json", help="output file, .json or .csv")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes (default: all cores)")
+    parser.add_argument("--model-complexity", type=int, default=1, choices=[0, 1, 2])
+    parser.add_argument("--specs", help="JSON file with extra/overridden exercise specs (see exercises.py)")
+    parser.add_argument("--cache", help="pose cache directory, clips seen before skip inference (see pose_cache.py)")
+    args = parser.parse_args()
+    if args.specs:
+        load_exercise_specs(args.specs)
+
+    try:
+        default_exercise = parse_exercise(args.exercise)
+    except ValueError as e:
+        parser.error(f"--exercise: {e}")
+    clips = []
+    for path, exercise_id in collect_clips(args.inputs, args.manifest):
+        if exercise_id is None:
+            exercise_id = exercise_from_filename(path)
+        if exercise_id is None:
+            exercise_id = default_exercise
+        if exercise_id is None:
+            print(f"Skipping {path}: can't tell the exercise, pass --exercise or use a manifest")
+            continue
+        clips.append((path, exercise_id))
+
+    if not clips:
+        parser.error("no clips to process")
+
+    started = time.perf_counter()
+    rows = run_batch(clips, args.out, workers=args.workers, model_complexity=args.model_complexity, specs=args.specs,
+                     cache_dir=args.cache)
+    failed = sum(1 for r in rows if r["error"])
+    print(f"Processed {len(rows)} clips ({failed} failed) in {time.perf_counter() - started:.1f}s -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
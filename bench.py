@@ -0,0 +1,243 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from exercises import EXERCISES
+from landmarks import NUM_LANDMARKS
+
+# Benchmarks for the per-frame hot path. Logic stages replay landmark fixtures (.npz with "points" (N, 33, 4),
+# "timestamps" (N,) and "exercise"), so they need no camera and no pose model and run on any CPU-only box.
+#
+#   python bench.py record clip.mp4 --exercise Push-up --out fixtures/push-up.npz
+#   python bench.py run [--fixtures DIR] [--video clip.mp4] [--save-baseline bench_baseline.json]
+#   python bench.py run --compare bench_baseline.json      (exits 1 if a stage regressed)
+
+
+def synthetic_fixture(exercise_id, frames=900, fps=30.0, seed=0):
+    # Deterministic stand-in for a recording: both arms bend and straighten every 2 s with landmark noise
+    rng = np.random.default_rng(seed)
+    t = np.arange(frames) / fps
+    points = np.zeros((frames, NUM_LANDMARKS, 4), dtype=np.float32)
+    points[..., 3] = 1.0
+    angle = np.radians(115 + 55 * np.cos(2 * np.pi * t / 2.0))
+    for shoulder, elbow, wrist, hip, knee, sign in ((11, 13, 15, 23, 25, 1), (12, 14, 16, 24, 26, -1)):
+        points[:, shoulder, :2] = (0.5 + sign * 0.1, 0.3)
+        points[:, elbow, :2] = (0.5 + sign * 0.1, 0.5)
+        points[:, wrist, 0] = 0.5 + sign * (0.1 + 0.2 * np.sin(angle))
+        points[:, wrist, 1] = 0.5 - 0.2 * np.cos(angle)
+        points[:, hip, :2] = (0.5 + sign * 0.08, 0.7)
+        points[:, knee, :2] = (0.5 + sign * 0.08, 0.9)
+    points[..., :3] += rng.normal(0, 0.005, points[..., :3].shape).astype(np.float32)
+    return {"name": f"synthetic-{EXERCISES[exercise_id]}", "points": points, "timestamps": t, "exercise": exercise_id}
+
+
+def load_fixtures(directory):
+    fixtures = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.npz"))):
+        data = np.load(path)
+        fixtures.append({"name": os.path.basename(path), "points": data["points"], "timestamps": data["timestamps"],
+                         "exercise": int(data["exercise"])})
+    return fixtures
+
+
+def record_fixture(video, exercise_id, out_path):
+    # Run the real pose model over a video once and keep its landmarks for model-free benchmarking
+    import cv2
+    import mediapipe as mp
+    from landmarks import landmarks_to_array
+
+    pose = mp.solutions.pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5)
+    vid = cv2.VideoCapture(video)
+    points, timestamps = [], []
+    while True:
+        ret, frame = vid.read()
+        if not ret:
+            break
+        result = pose.process(cv2.cvtColor(cv2.resize(frame, (640, 500)), cv2.COLOR_BGR2RGB))
+        if result.pose_landmarks:
+            points.append(landmarks_to_array(result.pose_landmarks.landmark))
+            timestamps.append(vid.get(cv2.CAP_PROP_POS_MSEC) / 1000)
+    vid.release()
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    np.savez_compressed(out_path, points=np.array(points, dtype=np.float32), timestamps=np.array(timestamps),
+                        exercise=exercise_id)
+    print(f"Recorded {len(points)} frames to {out_path}")
+
+
+def to_landmark_lists(points):
+    # Replayed frames look exactly like pose.process output to the tracker
+    from mediapipe.framework.formats import landmark_pb2
+    return [landmark_pb2.NormalizedLandmarkList(landmark=[
+        landmark_pb2.NormalizedLandmark(x=x, y=y, z=z, visibility=v) for x, y, z, v in frame.tolist()])
+        for frame in points]
+
+
+class _Result:
+    def __init__(self, pose_landmarks):
+        self.pose_landmarks = pose_landmarks
+
+
+def summarize(samples):
+    samples = np.asarray(samples) * 1e6  # microseconds
+    total = samples.sum() / 1e6
+    return {"frames": len(samples), "fps": round(len(samples) / total, 1) if total else 0.0,
+            "p50_us": round(float(np.percentile(samples, 50)), 1), "p99_us": round(float(np.percentile(samples, 99)), 1)}
+
+
+def bench_logic(fixture):
+    from mvp import ExerciseTracker
+
+    lists = to_landmark_lists(fixture["points"])
+    timestamps = fixture["timestamps"].tolist()
+    frame = np.zeros((500, 640, 3), dtype=np.uint8)
+
+    def new_tracker():
+        return ExerciseTracker(exercise_id=fixture["exercise"], pose=object())  # logic stages never call the model
+
+    stages = {}
+
+    tracker = new_tracker()
+    samples = []
+    for lm, t in zip(lists, timestamps):
+        start = time.perf_counter()
+        tracker.get_angles_from_landmarks(lm.landmark, t)
+        samples.append(time.perf_counter() - start)
+    stages["get_angles_from_landmarks"] = summarize(samples)
+
+    tracker = new_tracker()
+    inputs = [tracker.get_angles_from_landmarks(lm.landmark, t) for lm, t in zip(lists, timestamps)]
+    samples = []
+    for lm, (angles, keypoints) in zip(lists, inputs):
+        start = time.perf_counter()
+        tracker.check_good_posture(None, angles, tracker.exercise_type, keypoints, lm.landmark)
+        samples.append(time.perf_counter() - start)
+    stages["check_good_posture"] = summarize(samples)
+
+    for name, draw in (("count_reps", False), ("count_reps+draw", True)):
+        tracker = new_tracker()
+        samples = []
+        for lm, t, (angles, keypoints) in zip(lists, timestamps, inputs):
+            target = frame.copy() if draw else None
+            start = time.perf_counter()
+            tracker.count_reps(target, angles, _Result(lm), lm.landmark, keypoints, t)
+            samples.append(time.perf_counter() - start)
+        stages[name] = summarize(samples)
+        stages[name]["reps"] = tracker.rep_count
+
+    # Allocation pass, separate from timing since tracemalloc slows everything down
+    tracker = new_tracker()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for lm, t in zip(lists, timestamps):
+        angles, keypoints = tracker.get_angles_from_landmarks(lm.landmark, t)
+        tracker.count_reps(None, angles, _Result(lm), lm.landmark, keypoints, t)
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+    stages["allocations"] = {"retained_blocks": blocks, "peak_kib": round(peak / 1024, 1)}
+    return stages
+
+
+def bench_video(video, exercise_id):
+    # Full generate_frames path (capture, pose model, rep logic, JPEG encode) on a sample video
+    from frame_pipeline import FramePipeline
+    from pose_pool import PosePool
+    from sessions import SessionRegistry
+
+    registry = SessionRegistry(pose_pool=PosePool(size=1))
+    session = registry.create("bench", exercise_id)
+    session.open_capture(video)
+    started = time.perf_counter()
+    last = started
+    samples = []
+    for _ in FramePipeline(session).start().frames():
+        now = time.perf_counter()
+        samples.append(now - last)
+        last = now
+    registry.close_all()
+    if not samples:
+        return {"frames": 0}
+    stats = summarize(samples)
+    stats["fps"] = round(len(samples) / (last - started), 1)
+    return stats
+
+
+def compare(results, baseline, tolerance):
+    # A stage regresses when its p50 or p99 got more than tolerance slower than the stored baseline
+    regressions = []
+    for fixture, stages in results.items():
+        for stage, stats in stages.items():
+            base = baseline.get(fixture, {}).get(stage)
+            if not base:
+                continue
+            for key in ("p50_us", "p99_us"):
+                if key in stats and key in base and stats[key] > base[key] * (1 + tolerance):
+                    regressions.append(f"{fixture} {stage} {key}: {base[key]} -> {stats[key]}")
+    return regressions
+
+
+def run(args):
+    fixtures = load_fixtures(args.fixtures) if args.fixtures else []
+    if not fixtures:
+        fixtures = [synthetic_fixture(i) for i in range(len(EXERCISES))]
+
+    results = {}
+    for fixture in fixtures:
+        results[fixture["name"]] = bench_logic(fixture)
+    if args.video:
+        results["video:" + os.path.basename(args.video)] = {"generate_frames": bench_video(args.video, args.video_exercise)}
+
+    for name, stages in results.items():
+        print(name)
+        for stage, stats in stages.items():
+            print(f"  {stage:28s} " + "  ".join(f"{k}={v}" for k, v in stats.items()))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline written to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print("REGRESSION " + line)
+        if regressions:
+            return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-frame hot path benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    rec = sub.add_parser("record", help="record landmark fixtures from a video (needs the pose model)")
+    rec.add_argument("video")
+    rec.add_argument("--exercise", required=True, help="exercise id or name")
+    rec.add_argument("--out", required=True)
+
+    runner = sub.add_parser("run", help="run the benchmarks")
+    runner.add_argument("--fixtures", help="directory of .npz landmark fixtures (default: synthetic sequences)")
+    runner.add_argument("--video", help="also benchmark the full frame pipeline on this video")
+    runner.add_argument("--video-exercise", type=int, default=0)
+    runner.add_argument("--save-baseline", help="write results to this JSON file")
+    runner.add_argument("--compare", help="baseline JSON to check for regressions")
+    runner.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before flagging (0.2 = 20%%)")
+
+    args = parser.parse_args()
+    if args.command == "record":
+        exercise = int(args.exercise) if args.exercise.isdigit() else EXERCISES.index(args.exercise)
+        record_fixture(args.video, exercise, args.out)
+        return 0
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,32 @@
+import numpy as np
+
+
+class ScratchBuffers:
+    # Named arrays reused from frame to frame as cv2 dst= targets; one is only reallocated when the shape it's
+    # asked for changes (new source resolution or a different adaptive scale).
+    # Each array is overwritten by the next frame, so only use one where the previous result is finished with.
+    def __init__(self):
+        self.arrays = {}
+
+    def get(self, name, shape, dtype=np.uint8):
+        array = self.arrays.get(name)
+        if array is None or array.shape != shape or array.dtype != dtype:
+            array = self.arrays[name] = np.empty(shape, dtype)
+        return array
+
+
+class FrameRing:
+    # Fixed set of frame buffers handed out in rotation, for frames that travel through a FramePipeline's
+    # bounded queues. With more slots than frames that can be in flight at once (queue capacities plus one in
+    # each stage's hands) a slot is never handed out again while a stage still holds it, so nothing has to be
+    # returned explicitly, including frames a drop-oldest queue discards.
+    def __init__(self, slots):
+        self.slots = [None] * slots
+        self.index = 0
+
+    def next(self, shape, dtype=np.uint8):
+        self.index = (self.index + 1) % len(self.slots)
+        array = self.slots[self.index]
+        if array is None or array.shape != shape or array.dtype != dtype:
+            array = self.slots[self.index] = np.empty(shape, dtype)
+        return array
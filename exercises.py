@@ -0,0 +1,299 @@
+import json
+
+import numpy as np
+
+from landmarks import ANGLE_INDEX, LANDMARK_INDEX
+
+# Declarative exercise definitions. Everything ExerciseTracker does per exercise lives here, so a new
+# exercise (or a threshold tweak) is a data change: add an entry here or in a JSON file passed to
+# load_exercise_specs().
+#
+#   landmarks           landmark indices that must be visible (visibility >= min_visibility)
+#   posture             checked in order, the first failing rule's message is shown
+#                       {"angles": [...], "range": [lo, hi]}           every angle strictly inside (lo, hi)
+#                       {"require": [[a, "x"|"y", op, b], ...]}         keypoint comparisons that must all hold
+#   sides               optional, evaluate the states once per side with "{side}" substituted in angle names,
+#                       if the sides disagree the state is "mismatch"
+#   states              first entry whose angle ranges all match wins, otherwise "default"; null = open bound
+#   bad_states          states that flag bad posture
+#   transitions         rep state machine: in state "state" while armed == "armed", set armed to "to" and
+#                       add "count" reps
+#   timer_state         timed hold instead of reps: rep_count is the seconds spent in this state
+EXERCISE_SPECS = {
+    "Push-up": {
+        "landmarks": [11, 13, 15, 23, 25],  # Shoulders, elbows, wrists, hips, knees
+        "posture": [
+            {"angles": ["left_elbow", "right_elbow"], "range": [40, 180], "message": "Elbow angle incorrect"},
+            {"angles": ["left_hip_angle", "right_hip_angle"], "range": [10, 180], "message": "Hip angle incorrect"},
+            {"angles": ["left_shoulder", "right_shoulder"], "range": [0, 110], "message": "Shoulder angle incorrect"},
+            {"require": [["LEFT_WRIST", "y", ">=", "LEFT_ELBOW"], ["RIGHT_WRIST", "y", ">=", "RIGHT_ELBOW"]], "message": "Wrist is above elbow"},
+            {"require": [["LEFT_ELBOW", "y", ">=", "LEFT_SHOULDER"], ["RIGHT_ELBOW", "y", ">=", "RIGHT_SHOULDER"]], "message": "Elbow is above shoulder"},
+        ],
+        "sides": ["left", "right"],
+        "states": [
+            {"state": "Down", "angles": {"{side}_elbow": [None, 110]}},
+            {"state": "Up", "angles": {"{side}_elbow": [140, None]}},
+        ],
+        "default": "In Progress",
+        "mismatch": "Asymmetrical Movement",
+        "bad_states": ["Asymmetrical Movement"],
+        "transitions": [
+            {"state": "Down", "armed": False, "to": True, "count": 1},  # count on the way down
+            {"state": "Up", "armed": True, "to": False, "count": 0},
+        ],
+        "calories_per_minute": 7,
+    },
+    "Plank": {
+        "landmarks": [11, 12, 23, 24, 25, 26],  # Shoulders, hips, knees
+        "posture": [
+            {"angles": ["left_hip_angle", "right_hip_angle"], "range": [120, 180], "message": "Hips not straight"},
+            {"angles": ["left_shoulder", "right_shoulder"], "range": [60, 120], "message": "Shoulders not aligned properly"},
+            {"require": [["LEFT_HIP", "y", "<=", "LEFT_KNEE"], ["RIGHT_HIP", "y", "<=", "RIGHT_KNEE"]], "message": "Hips are below knees"},
+            {"require": [["LEFT_SHOULDER", "y", "<=", "LEFT_HIP"], ["RIGHT_SHOULDER", "y", "<=", "RIGHT_HIP"]], "message": "Shoulders are below hips"},
+        ],
+        "states": [
+            {"state": "Plank", "angles": {"left_hip_angle": [120, 180], "right_hip_angle": [120, 180]}},
+        ],
+        "default": "Not Plank",
+        "bad_states": ["Not Plank"],
+        "timer_state": "Plank",
+        "calories_per_minute": 4,
+    },
+    "Pull-up": {
+        "landmarks": [11, 13, 15],  # Shoulders, elbows, wrists
+        "posture": [
+            {"angles": ["left_shoulder", "right_shoulder"], "range": [10, None], "message": "Shoulder angle incorrect"},
+            {"require": [["LEFT_WRIST", "y", "<=", "LEFT_SHOULDER"], ["RIGHT_WRIST", "y", "<=", "RIGHT_SHOULDER"]], "message": "Wrist is not above shoulder"},
+            {"require": [["LEFT_WRIST", "y", "<=", "LEFT_ELBOW"], ["RIGHT_WRIST", "y", "<=", "RIGHT_ELBOW"]], "message": "Wrist is not above elbow"},
+        ],
+        "states": [
+            {"state": "Up", "angles": {"left_elbow": [None, 30], "left_shoulder": [None, 50],
+                                       "right_elbow": [None, 30], "right_shoulder": [None, 50]}},
+            {"state": "Down", "angles": {"left_elbow": [150, None], "right_elbow": [150, None]}},
+        ],
+        "default": "In Progress",
+        "bad_states": ["In Progress"],
+        "transitions": [
+            {"state": "Up", "armed": False, "to": True, "count": 0},  # only count once "Up" has been seen
+            {"state": "Down", "armed": True, "to": False, "count": 1},
+        ],
+        "calories_per_minute": 8,
+    },
+    "Hammer Curl": {
+        "landmarks": [11, 13, 15, 23, 24],  # Shoulders, elbows, wrists
+        "posture": [
+            {"angles": ["left_elbow", "right_elbow"], "range": [0, 180], "message": "Elbow angle incorrect"},
+            {"require": [["LEFT_ELBOW", "y", ">=", "LEFT_SHOULDER"], ["RIGHT_ELBOW", "y", ">=", "RIGHT_SHOULDER"]], "message": "Elbow is above shoulder"},
+            {"require": [["LEFT_WRIST", "y", ">=", "LEFT_SHOULDER"], ["RIGHT_WRIST", "y", ">=", "RIGHT_SHOULDER"]], "message": "Wrist is above shoulder"},
+            {"require": [["LEFT_WRIST", "x", "<", "LEFT_ELBOW"], ["RIGHT_WRIST", "x", ">", "RIGHT_ELBOW"]], "message": "Arms are not facing inward"},
+        ],
+        "sides": ["left", "right"],
+        "states": [
+            {"state": "Up", "angles": {"{side}_elbow": [None, 90]}},
+            {"state": "Down", "angles": {"{side}_elbow": [110, None]}},
+        ],
+        "default": "In Progress",
+        "mismatch": "Asymmetrical Movement",
+        "bad_states": ["Asymmetrical Movement"],
+        "transitions": [
+            {"state": "Up", "armed": False, "to": True, "count": 0},
+            {"state": "Down", "armed": True, "to": False, "count": 1},  # count when the arm is extended again
+        ],
+        "calories_per_minute": 5,
+    },
+    "Tricep Dip": {
+        "landmarks": [11, 13, 15, 23, 24],  # Shoulders, elbows, wrists
+        "posture": [
+            {"angles": ["left_elbow", "right_elbow"], "range": [40, 180], "message": "Elbow angle incorrect"},
+            {"require": [["LEFT_ELBOW", "y", ">=", "LEFT_SHOULDER"], ["RIGHT_ELBOW", "y", ">=", "RIGHT_SHOULDER"]], "message": "Elbow is above shoulder"},
+            {"require": [["LEFT_WRIST", "y", ">=", "LEFT_ELBOW"], ["RIGHT_WRIST", "y", ">=", "RIGHT_ELBOW"]], "message": "Wrist is above elbow"},
+            {"require": [["LEFT_WRIST", "x", "<", "LEFT_ELBOW"], ["RIGHT_WRIST", "x", ">", "RIGHT_ELBOW"]], "message": "Arms are not facing inward"},
+        ],
+        "sides": ["left", "right"],
+        "states": [
+            {"state": "Down", "angles": {"{side}_elbow": [None, 110]}},
+            {"state": "Up", "angles": {"{side}_elbow": [130, None]}},
+        ],
+        "default": "In Progress",
+        "mismatch": "Asymmetrical Movement",
+        "bad_states": ["Asymmetrical Movement"],
+        "transitions": [
+            {"state": "Down", "armed": False, "to": True, "count": 1},
+            {"state": "Up", "armed": True, "to": False, "count": 0},
+        ],
+        "calories_per_minute": 6,
+    },
+    "Tricep Pull-down": {
+        "landmarks": [11, 13, 15, 23, 24],  # Shoulders, elbows, wrists
+        "posture": [
+            {"angles": ["left_elbow", "right_elbow"], "range": [20, 170], "message": "Elbow angle incorrect"},
+            {"require": [["LEFT_WRIST", "x", "<", "LEFT_ELBOW"], ["RIGHT_WRIST", "x", ">", "RIGHT_ELBOW"]], "message": "Arms are not facing inward"},
+            {"angles": ["left_hip_angle", "right_hip_angle"], "range": [140, 180], "message": "Not standing straight"},
+        ],
+        "states": [
+            {"state": "Down", "angles": {"left_elbow": [130, None], "right_elbow": [130, None]}},
+            {"state": "Up", "angles": {"left_elbow": [None, 80], "right_elbow": [None, 80]}},
+        ],
+        "default": "In Progress",
+        "bad_states": ["In Progress"],
+        "transitions": [
+            {"state": "Down", "armed": False, "to": True, "count": 1},
+            {"state": "Up", "armed": True, "to": False, "count": 0},
+        ],
+        "calories_per_minute": 6,
+    },
+}
+EXERCISES = list(EXERCISE_SPECS)
+
+AXES = {"x": 0, "y": 1}
+# Every comparison is rewritten as sign * (a - b) > 0 (strict) or >= 0
+OPERATORS = {"<": (-1, True), "<=": (-1, False), ">": (1, True), ">=": (1, False)}
+
+
+def _compile_ranges(angle_ranges):
+    # {angle name: [lo, hi]} -> index array plus lower/upper bound arrays
+    names = list(angle_ranges)
+    idx = np.array([ANGLE_INDEX[name] for name in names])
+    lo = np.array([-np.inf if angle_ranges[n][0] is None else angle_ranges[n][0] for n in names], dtype=np.float64)
+    hi = np.array([np.inf if angle_ranges[n][1] is None else angle_ranges[n][1] for n in names], dtype=np.float64)
+    return idx, lo, hi
+
+
+def _in_ranges(values, compiled):
+    idx, lo, hi = compiled
+    selected = values[idx]
+    return bool(np.all((selected > lo) & (selected < hi)))
+
+
+def _in_ranges_batch(values, compiled):
+    # Same test over any leading shape, (..., angles) -> (...)
+    idx, lo, hi = compiled
+    selected = values[..., idx]
+    return np.all((selected > lo) & (selected < hi), axis=-1)
+
+
+class PostureRule:
+    def __init__(self, rule):
+        self.message = rule["message"]
+        if "angles" in rule:
+            self.ranges = _compile_ranges({name: rule["range"] for name in rule["angles"]})
+            self.compare = None
+        else:
+            self.ranges = None
+            conditions = rule["require"]
+            self.compare = (
+                np.array([LANDMARK_INDEX[c[0]] for c in conditions]),
+                np.array([LANDMARK_INDEX[c[3]] for c in conditions]),
+                np.array([AXES[c[1]] for c in conditions]),
+                np.array([OPERATORS[c[2]][0] for c in conditions], dtype=np.float64),
+                np.array([OPERATORS[c[2]][1] for c in conditions]),
+            )
+
+    def passes(self, angle_values, points):
+        if self.ranges is not None:
+            return _in_ranges(angle_values, self.ranges)
+        a, b, axis, sign, strict = self.compare
+        diff = sign * (points[a, axis].astype(np.float64) - points[b, axis])
+        return bool(np.all(np.where(strict, diff > 0, diff >= 0)))
+
+    def passes_batch(self, angle_values, points):
+        if self.ranges is not None:
+            return _in_ranges_batch(angle_values, self.ranges)
+        a, b, axis, sign, strict = self.compare
+        diff = sign * (points[..., a, axis].astype(np.float64) - points[..., b, axis])
+        return np.all(np.where(strict, diff > 0, diff >= 0), axis=-1)
+
+
+class ExerciseRules:
+    # One exercise spec compiled to index arrays, so per-frame evaluation is array lookups instead of string dispatch
+    def __init__(self, name, spec):
+        self.name = name
+        self.landmarks = np.array(spec.get("landmarks", []), dtype=int)
+        self.min_visibility = spec.get("min_visibility", 0.1)
+        self.posture = [PostureRule(rule) for rule in spec.get("posture", [])]
+        self.default = spec.get("default", "In Progress")
+        self.mismatch = spec.get("mismatch", "Asymmetrical Movement")
+        self.bad_states = set(spec.get("bad_states", []))
+        self.timer_state = spec.get("timer_state")
+        self.calories_per_minute = spec.get("calories_per_minute", 5)
+
+        sides = spec.get("sides") or [None]
+        self.sides = [
+            [(entry["state"], _compile_ranges({name.replace("{side}", side) if side else name: bounds
+                                               for name, bounds in entry["angles"].items()}))
+             for entry in spec.get("states", [])]
+            for side in sides
+        ]
+        self.transitions = {(t["state"], t["armed"]): (t["to"], t.get("count", 0)) for t in spec.get("transitions", [])}
+        # Every state classify() can return, "" being the tracker's state before the first frame
+        self.state_names = list(dict.fromkeys(["", self.default, self.mismatch] + [s["state"] for s in spec.get("states", [])]))
+
+    def visible(self, points):
+        return not (points[self.landmarks, 3] < self.min_visibility).any()
+
+    def check_posture(self, angle_values, points):
+        # Returns (ok, message, rule number) where rule number 0 is the visibility check
+        if not self.visible(points):
+            return False, f"Body parts for {self.name} not visible", 0
+        for i, rule in enumerate(self.posture, 1):
+            if not rule.passes(angle_values, points):
+                return False, rule.message, i
+        return True, "", None
+
+    def classify(self, angle_values):
+        # Returns (state, bad_posture)
+        states = []
+        for side_states in self.sides:
+            state = self.default
+            for name, ranges in side_states:
+                if _in_ranges(angle_values, ranges):
+                    state = name
+                    break
+            states.append(state)
+        state = states[0] if all(s == states[0] for s in states) else self.mismatch
+        return state, state in self.bad_states
+
+    def check_posture_batch(self, angle_values, points):
+        # check_posture over whole sequences: (..., angles) and (..., 33, 4) -> bool (...)
+        ok = ~(points[..., self.landmarks, 3] < self.min_visibility).any(axis=-1)
+        for rule in self.posture:
+            ok &= rule.passes_batch(angle_values, points)
+        return ok
+
+    def classify_batch(self, angle_values):
+        # classify over whole sequences, returns indices into state_names
+        codes = {name: i for i, name in enumerate(self.state_names)}
+        per_side = []
+        for side_states in self.sides:
+            state = np.full(angle_values.shape[:-1], codes[self.default], dtype=np.uint8)
+            for name, ranges in reversed(side_states):  # reversed so the first matching entry is written last
+                state = np.where(_in_ranges_batch(angle_values, ranges), codes[name], state).astype(np.uint8)
+            per_side.append(state)
+        agree = np.all([s == per_side[0] for s in per_side], axis=0)
+        return np.where(agree, per_side[0], codes[self.mismatch]).astype(np.uint8)
+
+    def step(self, state, armed):
+        # Advance the rep state machine, returns (armed, reps to add)
+        return self.transitions.get((state, armed), (armed, 0))
+
+
+_compiled = {}
+
+
+def get_rules(name):
+    rules = _compiled.get(name)
+    if rules is None:
+        rules = _compiled[name] = ExerciseRules(name, EXERCISE_SPECS[name])
+    return rules
+
+
+def load_exercise_specs(path):
+    # Add or override exercises from a JSON file with the same layout as EXERCISE_SPECS
+    with open(path) as f:
+        specs = json.load(f)
+    for name, spec in specs.items():
+        EXERCISE_SPECS[name] = spec
+        _compiled.pop(name, None)
+        if name not in EXERCISES:
+            EXERCISES.append(name)
+    return list(specs)
@@ -0,0 +1,116 @@
+import math
+
+import numpy as np
+
+
+class OneEuroFilter:
+    # One-Euro filter (Casiez et al.) applied element-wise to a whole landmark array at once: heavy smoothing
+    # while a joint is still, little lag while it moves fast. Only x/y/z are filtered, visibility passes through.
+    def __init__(self, min_cutoff=1.0, beta=5.0, d_cutoff=1.0, max_gap=0.5):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.max_gap = max_gap  # seconds without landmarks after which we start over instead of smoothing across
+        self.reset()
+
+    def reset(self):
+        self.prev = None
+        self.prev_dx = None
+        self.prev_t = None
+
+    @staticmethod
+    def _alpha(cutoff, dt):
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def __call__(self, points, t):
+        coords = points[..., :3].astype(np.float64)
+        dt = None if self.prev_t is None else t - self.prev_t
+        if self.prev is None or dt is None or dt <= 0 or dt > self.max_gap:
+            self.prev = coords
+            self.prev_dx = np.zeros_like(coords)
+            self.prev_t = t
+            return points
+
+        dx = (coords - self.prev) / dt
+        a_d = self._alpha(self.d_cutoff, dt)
+        dx_hat = a_d * dx + (1 - a_d) * self.prev_dx
+        cutoff = self.min_cutoff + self.beta * np.abs(dx_hat)
+        tau = 1.0 / (2 * np.pi * cutoff)
+        a = 1.0 / (1.0 + tau / dt)
+        smoothed = a * coords + (1 - a) * self.prev
+
+        self.prev = smoothed
+        self.prev_dx = dx_hat
+        self.prev_t = t
+        out = points.copy()
+        out[..., :3] = smoothed
+        return out
+
+
+def one_euro_batch(points, timestamps, valid, min_cutoff=1.0, beta=5.0, d_cutoff=1.0, max_gap=0.5):
+    # OneEuroFilter over (sessions, frames, 33, 4) for replaying recordings. The filter is recursive in time,
+    # so frames are stepped one at a time with all sessions updated together. Frames where valid is False
+    # (nobody detected) are skipped just like the tracker never sees them. Same arithmetic as the class.
+    out = points.copy()
+    sessions, frames = valid.shape
+    prev = np.zeros(points.shape[:1] + points.shape[2:-1] + (3,))
+    prev_dx = np.zeros_like(prev)
+    prev_t = np.full(sessions, np.nan)
+    for k in range(frames):
+        rows = np.flatnonzero(valid[:, k])
+        if not len(rows):
+            continue
+        t = timestamps[rows, k]
+        coords = points[rows, k, ..., :3].astype(np.float64)
+        dt = t - prev_t[rows]
+        restart = np.isnan(dt) | (dt <= 0) | (dt > max_gap)
+        dt = np.where(restart, 1.0, dt)[:, None, None]
+
+        dx = (coords - prev[rows]) / dt
+        tau_d = 1.0 / (2 * np.pi * d_cutoff)
+        a_d = 1.0 / (1.0 + tau_d / dt)
+        dx_hat = a_d * dx + (1 - a_d) * prev_dx[rows]
+        cutoff = min_cutoff + beta * np.abs(dx_hat)
+        tau = 1.0 / (2 * np.pi * cutoff)
+        a = 1.0 / (1.0 + tau / dt)
+        smoothed = a * coords + (1 - a) * prev[rows]
+
+        keep = restart[:, None, None]
+        prev[rows] = np.where(keep, coords, smoothed)
+        prev_dx[rows] = np.where(keep, 0.0, dx_hat)
+        prev_t[rows] = t
+        filtered = rows[~restart]
+        out[filtered, k, ..., :3] = smoothed[~restart]
+    return out
+
+
+class StateDebouncer:
+    # A new exercise state only takes over once it has been seen continuously for min_hold seconds, so a
+    # one-frame flicker can't arm or count a rep. Time based rather than frame based so it behaves the same
+    # when frames are being skipped.
+    def __init__(self, min_hold=0.1):
+        self.min_hold = min_hold
+        self.rejected = 0  # candidate states that flickered away before being accepted
+        self.reset()
+
+    def reset(self):
+        self.state = ""
+        self.candidate = None
+        self.since = None
+
+    def update(self, state, t):
+        if state == self.state:
+            if self.candidate is not None:
+                self.rejected += 1
+            self.candidate = None
+            return self.state
+        if state != self.candidate:
+            if self.candidate is not None:
+                self.rejected += 1
+            self.candidate = state
+            self.since = t
+        if t - self.since >= self.min_hold:
+            self.state = state
+            self.candidate = None
+        return self.state
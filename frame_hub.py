@@ -0,0 +1,243 @@
+import threading
+
+import cv2
+
+from buffers import ScratchBuffers
+from frame_pipeline import FramePipeline, FrameQueue, mjpeg_part
+from metrics import metrics
+
+
+class StreamProfile:
+    # MJPEG encode settings for one viewer: the most it asked for (?profile=high|medium|low or ?width=, ?quality=,
+    # ?fps=) and, when adaptive, a step below that picked from how long sends take, the same way AdaptiveRate
+    # sheds load on the inference side. Viewers on the same settings share one encode per frame.
+    PRESETS = {"high": (640, 85, None), "medium": (480, 70, None), "low": (320, 55, 15)}  # width, quality, max fps
+    STEPS = ((1.0, 0), (0.75, 15), (0.5, 30))  # (width factor, quality reduction) per adaptive level
+    MIN_QUALITY = 30
+
+    def __init__(self, width=640, quality=85, max_fps=None, adaptive=True, slow_send=0.08, fast_send=0.02, cooldown=30):
+        self.width = width
+        self.quality = quality
+        self.max_fps = max_fps
+        self.adaptive = adaptive
+        self.slow_send = slow_send  # seconds per frame send above which the stream steps down
+        self.fast_send = fast_send  # ... and below which it steps back up
+        self.cooldown = cooldown
+        self.level = 0
+        self.send_time = None
+        self.dropped = 0                  # subscriber's dropped frames as of the last update
+        self.dropped_since_change = 0
+        self.updates_since_change = 0
+        self.next_due = None
+
+    @classmethod
+    def from_query(cls, args):
+        # args: request.args or any mapping of query parameters, raises ValueError on bad values
+        name = args.get("profile") or "high"
+        if name not in cls.PRESETS:
+            raise ValueError(f"Unknown stream profile {name!r}, use one of {', '.join(cls.PRESETS)}")
+        width, quality, max_fps = cls.PRESETS[name]
+        width = int(args.get("width", width))
+        quality = int(args.get("quality", quality))
+        max_fps = float(args["fps"]) if args.get("fps") else max_fps
+        if not 16 <= width <= 4096 or not 10 <= quality <= 100 or (max_fps is not None and max_fps <= 0):
+            raise ValueError("Stream width must be 16-4096, quality 10-100 and fps above 0")
+        return cls(width, quality, max_fps, adaptive=args.get("adaptive", "1") != "0")
+
+    def encoding(self, frame_size):
+        # (width, height, quality) to encode at for a pipeline producing frame_size frames, never upscaled
+        frame_width, frame_height = frame_size
+        factor, quality_drop = self.STEPS[self.level]
+        width = max(16, min(frame_width, int(self.width * factor)))
+        height = max(16, round(frame_height * width / frame_width))
+        return width, height, max(self.MIN_QUALITY, self.quality - quality_drop)
+
+    def accepts(self, timestamp):
+        # Frame-rate cap, frames in between are skipped before they're encoded. Each accepted frame moves the
+        # next due time on by one interval, so the cap averages out right when it doesn't divide the source rate.
+        if not self.max_fps:
+            return True
+        interval = 1 / self.max_fps
+        if self.next_due is not None and timestamp < self.next_due - 0.001:
+            if self.next_due - timestamp <= 2 * interval:
+                return False
+            self.next_due = None  # time went backwards, e.g. a new clip was opened
+        self.next_due = timestamp + interval if self.next_due is None else max(self.next_due + interval, timestamp)
+        return True
+
+    def update(self, send_seconds, dropped=0):
+        # Called after each frame is sent with how long the send took and the subscriber's total dropped frames
+        self.send_time = send_seconds if self.send_time is None else 0.8 * self.send_time + 0.2 * send_seconds
+        self.dropped_since_change += dropped - self.dropped
+        self.dropped = dropped
+        self.updates_since_change += 1
+        if not self.adaptive or self.updates_since_change < self.cooldown:
+            return
+        # Losing more than one frame in ten to a full queue means the link can't keep up either
+        falling_behind = self.dropped_since_change * 10 > self.updates_since_change
+        if (falling_behind or self.send_time > self.slow_send) and self.level < len(self.STEPS) - 1:
+            self.level += 1
+        elif not self.dropped_since_change and self.send_time < self.fast_send and self.level > 0:
+            self.level -= 1
+        else:
+            return
+        self.updates_since_change = 0
+        self.dropped_since_change = 0
+
+
+class Subscriber:
+    # One viewer of a FrameHub. Each has its own small queue that drops its oldest frame when the viewer falls
+    # behind, so a slow client only loses frames itself and never holds up the pipeline or the other viewers.
+    def __init__(self, kind, maxsize=2, profile=None):
+        self.kind = kind
+        self.profile = profile or (StreamProfile() if kind == "mjpeg" else None)
+        self.queue = FrameQueue(maxsize, drop_oldest=True, on_drop=lambda: metrics.count("subscriber_dropped_frames"))
+
+    @property
+    def dropped(self):
+        return self.queue.dropped
+
+    def deliver(self, payload):
+        self.queue.put(payload)
+
+    def sent(self, seconds):
+        # How long handing the last payload to the client took, drives the adaptive StreamProfile
+        if self.profile:
+            self.profile.update(seconds, self.dropped)
+
+    def close(self):
+        self.queue.close()
+
+    def __iter__(self):
+        # Payloads until the stream ends or the subscriber is closed
+        while True:
+            payload = self.queue.get()
+            if payload is None:
+                break
+            yield payload
+
+
+class FrameHub:
+    # Publish/subscribe in front of one session's FramePipeline: however many viewers a session has (the user's
+    # page, a trainer's dashboard, a recorder), frames are captured and run through the model once, annotated
+    # once, JPEG-encoded once per distinct StreamProfile setting, and each landmark format is serialised once,
+    # then handed to every subscriber of that kind. The pipeline starts with the first subscriber and stops
+    # when the last one leaves; when the source runs out every subscriber's stream ends.
+    KINDS = ("mjpeg", "json", "binary")  # mjpeg payloads are complete multipart parts, see frame_pipeline.mjpeg_part
+    LIVE_BUFFER = 2  # frames a subscriber may fall behind before its oldest are dropped
+    FILE_BUFFER = 8  # uploaded clips run faster than real time, a bit more slack so viewers see every frame
+
+    def __init__(self, session, size=(640, 500), target_latency=0.15):
+        self.session = session
+        self.size = size
+        self.target_latency = target_latency
+        self.subscribers = []
+        self.kinds = frozenset()  # formats someone is subscribed to, read by the pipeline on every frame
+        self.pipeline = None
+        self.buffers = ScratchBuffers()  # downscaled copies for smaller profiles, only used from the encode thread
+        self.lock = threading.Lock()
+        self.closed = False
+        self.paused = False  # the session is switching source, see pause()
+
+    def subscribe(self, kind="mjpeg", subscriber=None, profile=None):
+        # Anything with kind, profile, deliver(payload) and close() can subscribe, see async_stream.py
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown stream format {kind!r}")
+        subscriber = subscriber or Subscriber(kind, self.buffer_size(), profile)
+        with self.lock:
+            if self.closed:
+                subscriber.close()
+                return subscriber
+            self.subscribers.append(subscriber)
+            self.kinds = frozenset(s.kind for s in self.subscribers)
+            if self.pipeline is None and not self.paused:
+                self.pipeline = FramePipeline(self.session, self.size, target_latency=self.target_latency, hub=self).start()
+        return subscriber
+
+    def pause(self):
+        # Stops the pipeline without ending anyone's stream while the session opens another source. A pipeline is
+        # built for one kind of source (drop-oldest queues and AdaptiveRate only for live ones), so resume()
+        # starts a new one for whoever is subscribed by then.
+        with self.lock:
+            self.paused = True
+            pipeline, self.pipeline = self.pipeline, None
+        if pipeline:
+            pipeline.stop()
+
+    def resume(self):
+        with self.lock:
+            self.paused = False
+            if self.subscribers and self.pipeline is None and not self.closed:
+                self.pipeline = FramePipeline(self.session, self.size, target_latency=self.target_latency, hub=self).start()
+
+    def unsubscribe(self, subscriber):
+        pipeline = None
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+            self.kinds = frozenset(s.kind for s in self.subscribers)
+            if not self.subscribers:
+                pipeline, self.pipeline = self.pipeline, None
+        subscriber.close()
+        if pipeline:
+            pipeline.stop()  # nobody is watching, don't keep the camera and the model busy
+
+    def buffer_size(self):
+        return self.LIVE_BUFFER if self.session.live else self.FILE_BUFFER
+
+    def wants(self, kind):
+        return kind in self.kinds
+
+    def viewers(self):
+        with self.lock:
+            return len(self.subscribers)
+
+    def publish(self, payloads, frame=None, timestamp=None):
+        # Called from the pipeline's encode thread with {kind: bytes} for one frame, plus the annotated frame
+        # when anyone wants video
+        with self.lock:
+            subscribers = list(self.subscribers)
+        parts = {}
+        for subscriber in subscribers:
+            if subscriber.kind == "mjpeg":
+                if frame is None or not subscriber.profile.accepts(timestamp or 0.0):
+                    continue
+                encoding = subscriber.profile.encoding((frame.shape[1], frame.shape[0]))
+                if encoding not in parts:
+                    parts[encoding] = self._encode(frame, *encoding)
+                payload = parts[encoding]
+            else:
+                payload = payloads.get(subscriber.kind)
+            if payload is not None:
+                subscriber.deliver(payload)
+
+    def _encode(self, frame, width, height, quality):
+        start = metrics.start()
+        if (width, height) != (frame.shape[1], frame.shape[0]):
+            frame = cv2.resize(frame, (width, height), dst=self.buffers.get((width, height), (height, width, 3)),
+                               interpolation=cv2.INTER_AREA)
+        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        metrics.observe("encode", start)
+        return mjpeg_part(buffer) if ret else None
+
+    def finished(self, pipeline):
+        # The pipeline drained (end of file, session closed or stopped); end the streams it was feeding
+        with self.lock:
+            if pipeline is not self.pipeline:
+                return  # stopped after the last viewer left, a new pipeline may already be running
+            self.pipeline = None
+            subscribers, self.subscribers = self.subscribers, []
+            self.kinds = frozenset()
+        for subscriber in subscribers:
+            subscriber.close()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            pipeline, self.pipeline = self.pipeline, None
+            subscribers, self.subscribers = self.subscribers, []
+            self.kinds = frozenset()
+        if pipeline:
+            pipeline.stop()
+        for subscriber in subscribers:
+            subscriber.close()
@@ -0,0 +1,247 @@
+import collections
+import json
+import threading
+import time
+
+import cv2
+
+from buffers import FrameRing
+from metrics import metrics
+
+MJPEG_PART_HEAD = b"--frame\r\nContent-Type: image/jpeg\r\n\r\n"
+
+
+def mjpeg_part(jpeg):
+    # One multipart/x-mixed-replace part built straight from imencode's buffer: a single copy instead of
+    # tobytes() and then a concatenation for every viewer
+    return b"".join((MJPEG_PART_HEAD, jpeg, b"\r\n"))
+
+
+class FrameQueue:
+    # Small bounded queue between pipeline stages. With drop_oldest a full queue discards its oldest
+    # frame so live streams always move on to the newest one, otherwise put() waits (backpressure).
+    def __init__(self, maxsize=2, drop_oldest=True, on_drop=None):
+        self.maxsize = maxsize
+        self.drop_oldest = drop_oldest
+        self.on_drop = on_drop
+        self.items = collections.deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        with self.cond:
+            if self.drop_oldest:
+                while len(self.items) >= self.maxsize:
+                    self.items.popleft()
+                    self.dropped += 1
+                    if self.on_drop:
+                        self.on_drop()
+            else:
+                while len(self.items) >= self.maxsize and not self.closed:
+                    self.cond.wait()
+            if self.closed:
+                return False
+            self.items.append(item)
+            self.cond.notify_all()
+            return True
+
+    def get(self):
+        # Returns None once the queue is closed and drained
+        with self.cond:
+            while not self.items and not self.closed:
+                self.cond.wait()
+            if not self.items:
+                return None
+            item = self.items.popleft()
+            self.cond.notify_all()
+            return item
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+class AdaptiveRate:
+    # Keeps live end-to-end latency near a target by running inference on every Nth frame first, and only
+    # once that's at max_stride by shrinking the inference input. Pose runs its landmark model on a fixed-size
+    # crop, so a smaller input saves little more than the resize and colour conversion (27-31 ms per 640x500
+    # frame at every scale, within noise) while costing landmark detail; skipping frames is what sheds load.
+    # Rep counting stays correct because count_reps works off frame timestamps and up/down transitions,
+    # max_stride bounds how far the sample rate can fall. Recovery undoes the steps in reverse.
+    SCALES = (1.0, 0.75, 0.5)
+
+    def __init__(self, target_latency=0.15, max_stride=3, cooldown=15):
+        self.target_latency = target_latency
+        self.max_stride = max_stride
+        self.cooldown = cooldown
+        self.scale_index = 0
+        self.stride = 1
+        self.latency = None
+        self.frame_no = 0
+        self.updates_since_change = 0
+
+    @property
+    def scale(self):
+        return self.SCALES[self.scale_index]
+
+    def should_process(self):
+        self.frame_no += 1
+        return self.frame_no % self.stride == 0
+
+    def update(self, latency):
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        self.updates_since_change += 1
+        if self.updates_since_change < self.cooldown:
+            return
+        if self.latency > self.target_latency * 1.2:
+            if self.stride < self.max_stride:
+                self.stride += 1
+            elif self.scale_index < len(self.SCALES) - 1:
+                self.scale_index += 1
+            else:
+                return
+        elif self.latency < self.target_latency * 0.6:
+            if self.scale_index > 0:
+                self.scale_index -= 1
+            elif self.stride > 1:
+                self.stride -= 1
+            else:
+                return
+        else:
+            return
+        self.updates_since_change = 0
+
+
+class FramePipeline:
+    # capture -> inference -> encode, each on its own thread so decoding and JPEG encoding overlap pose.process.
+    # output="json" or "binary" streams only landmarks + rep state: no drawing and no JPEG encode stage.
+    # With a hub (see frame_hub.py) each frame is rendered in every format the hub's subscribers want and
+    # published to it instead of going through frames().
+    # Resized frames live in a FrameRing, so a steady stream reuses the same few arrays instead of allocating.
+    def __init__(self, session, size=(640, 500), queue_size=2, target_latency=0.15, output="jpeg", hub=None):
+        self.session = session
+        self.size = size
+        self.output = output
+        self.hub = hub
+        drop = session.live  # uploaded files must not skip frames or reps get lost
+        # Live feeds keep a single slot after capture so inference always starts on the freshest frame
+        self.captured = FrameQueue(1 if drop else queue_size, drop, session.count_dropped)
+        self.processed = FrameQueue(queue_size, drop, session.count_dropped)
+        self.encoded = FrameQueue(queue_size, drop, session.count_dropped)
+        self.rate = AdaptiveRate(target_latency) if session.live else None
+        # Enough slots for every frame the queues can hold plus the one each stage is working on
+        self.ring = FrameRing(self.captured.maxsize + self.processed.maxsize + 4)
+        self.threads = []
+
+    def start(self):
+        encode = self.output == "jpeg" or self.hub
+        stages = (self._capture, self._infer, self._encode) if encode else (self._capture, self._infer)
+        for target in stages:
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self, timeout=2):
+        # Waits for the stage threads so a pipeline started next never has this one still reading the session.
+        # Called from the encode thread too (via the hub), which can't wait for itself.
+        if self.threads:
+            self.session.interrupt_read(self.threads[0])  # the capture stage
+        for q in (self.captured, self.processed, self.encoded):
+            q.close()
+        deadline = time.monotonic() + timeout
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join(max(0, deadline - time.monotonic()))
+
+    def dropped(self):
+        return self.captured.dropped + self.processed.dropped + self.encoded.dropped
+
+    def _capture(self):
+        try:
+            while True:
+                width, height = self.size
+                success, frame, timestamp, index = self.session.read(self.size, self.ring.next((height, width, 3)))
+                if not success:
+                    break
+                if not self.captured.put((frame, timestamp, index)):
+                    break
+        finally:
+            self.captured.close()
+
+    def _infer(self):
+        try:
+            while True:
+                item = self.captured.get()
+                if item is None:
+                    break
+                frame, timestamp, index = item
+                if self.rate and not self.rate.should_process():
+                    self.session.count_dropped()
+                    continue  # shed load on a live feed that can't keep up
+                scale = self.rate.scale if self.rate else 1.0
+                draw = self.hub.wants("mjpeg") if self.hub else self.output == "jpeg"
+                result = self.session.process_frame(frame, timestamp, scale, draw, index)
+                if result is None:
+                    break  # session closed under us
+                if self.hub:
+                    payloads = {}
+                    if self.hub.wants("json"):
+                        payloads["json"] = json.dumps(self.session.frame_state(result, timestamp)).encode()
+                    if self.hub.wants("binary"):
+                        payloads["binary"] = self.session.packed_state(result, timestamp)
+                    if not self.processed.put((frame if draw else None, timestamp, payloads)):
+                        break
+                    continue
+                if draw:
+                    if not self.processed.put((frame, timestamp, None)):
+                        break
+                    continue
+                if self.output == "binary":
+                    payload = self.session.packed_state(result, timestamp)
+                else:
+                    payload = json.dumps(self.session.frame_state(result, timestamp)).encode()
+                if self.rate:
+                    self.rate.update(time.time() - timestamp)
+                if not self.encoded.put(payload):
+                    break
+        finally:
+            if not self.session.live:
+                self.session.finish_clip()
+            self.processed.close()
+            if self.output != "jpeg" and not self.hub:
+                self.encoded.close()
+
+    def _encode(self):
+        try:
+            while True:
+                item = self.processed.get()
+                if item is None:
+                    break
+                frame, timestamp, payloads = item
+                if self.hub:
+                    self.hub.publish(payloads, frame, timestamp)  # encodes once per subscribed StreamProfile
+                    if self.rate:
+                        self.rate.update(time.time() - timestamp)
+                    continue
+                start = metrics.start()
+                ret, buffer = cv2.imencode('.jpg', frame)
+                metrics.observe("encode", start)
+                if self.rate:
+                    self.rate.update(time.time() - timestamp)
+                if ret and not self.encoded.put(buffer.tobytes()):
+                    break
+        finally:
+            self.encoded.close()
+            if self.hub:
+                self.hub.finished(self)
+
+    def frames(self):
+        # JPEG bytes, or serialized landmark states in json/binary output mode
+        while True:
+            payload = self.encoded.get()
+            if payload is None:
+                break
+            yield payload
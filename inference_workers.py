@@ -0,0 +1,306 @@
+import atexit
+import os
+import queue
+import struct
+import subprocess
+import sys
+import threading
+import traceback
+from multiprocessing import resource_tracker, shared_memory
+
+import cv2
+import numpy as np
+
+from landmarks import NUM_LANDMARKS, PoseResult, landmarks_to_array
+from metrics import metrics
+from pose_pool import PoolExhausted
+
+# Fixed-size messages on the worker's stdin/stdout, frames and landmarks stay in shared memory
+REQUEST = struct.Struct("<BIIIQ")  # op, slot, height, width, session key
+RESPONSE = struct.Struct("<IB")    # slot, status
+PROCESS, RESET, RELEASE = 1, 2, 3
+NO_POSE, POSE, FAILED, READY = 0, 1, 2, 3
+READY_SLOT = 0xFFFFFFFF
+RESULT_BYTES = NUM_LANDMARKS * 4 * 4  # (33, 4) float32 written back by the worker
+FRAME_OFFSET = 576                    # frames start 64-byte aligned after the result
+
+
+class WorkerCrashed(Exception):
+    pass
+
+
+class _Waiter:
+    __slots__ = ("event", "status")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.status = None  # stays None when the worker died before answering
+
+
+class InferenceWorker:
+    # One worker process and the ring of shared-memory slots its frames go through. A request copies the RGB
+    # frame into a free slot and sends a small fixed-size header down the pipe; the worker runs that session's
+    # Pose graph straight on the slot and writes the landmarks back into it before answering, so images are
+    # never pickled or copied a second time. Slots also bound how many frames can be queued at one worker.
+    # A worker that dies is restarted on the next request; its sessions carry on with fresh graphs.
+    def __init__(self, index, slots=4, max_pixels=1280 * 720, prewarm=1, model_complexity=1,
+                 min_detection_confidence=0.5, min_tracking_confidence=0.5, timeout=30):
+        self.index = index
+        self.slots = slots
+        self.max_pixels = max_pixels  # larger frames are downscaled before they're copied in
+        self.slot_bytes = FRAME_OFFSET + max_pixels * 3
+        self.args = [str(slots), str(self.slot_bytes), str(prewarm), str(model_complexity),
+                     str(min_detection_confidence), str(min_tracking_confidence)]
+        self.timeout = timeout  # seconds without an answer before the worker is considered hung and killed
+        self.memory = shared_memory.SharedMemory(create=True, size=slots * self.slot_bytes)
+        self.ring = np.ndarray((slots, self.slot_bytes), np.uint8, self.memory.buf)
+        self.free = queue.Queue()
+        for slot in range(slots):
+            self.free.put(slot)
+        self.pending = {}  # slot -> _Waiter
+        self.sessions = 0  # routed here, maintained by InferenceWorkerPool
+        self.process = None
+        self.started = 0
+        self.ready = threading.Event()
+        self.error = None  # set when the process exits before it's ready, it isn't respawned after that
+        self.closed = False
+        self.lock = threading.Lock()  # process lifecycle, pending and writes to the pipe
+        with self.lock:
+            self._start()
+
+    def _start(self):
+        # Caller holds self.lock. A plain interpreter running this file rather than multiprocessing, so the
+        # worker never re-imports the web app's main module and starting one is safe from any thread.
+        here = os.path.abspath(__file__)
+        self.process = subprocess.Popen([sys.executable, here, self.memory.name] + self.args,
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=os.path.dirname(here))
+        self.started += 1
+        if self.started > 1:
+            metrics.count("inference_worker_restarts")
+        threading.Thread(target=self._read_responses, args=(self.process,), daemon=True,
+                         name=f"inference-worker-{self.index}").start()
+
+    def _read_responses(self, process):
+        while True:
+            message = process.stdout.read(RESPONSE.size)
+            if len(message) < RESPONSE.size:
+                break
+            slot, status = RESPONSE.unpack(message)
+            if status == READY:
+                self.ready.set()
+                continue
+            with self.lock:
+                waiter = self.pending.pop(slot, None)
+            if waiter:
+                waiter.status = status
+                waiter.event.set()
+        code = process.wait()
+        with self.lock:
+            if process is self.process:
+                self.process = None
+                if not self.ready.is_set() and not self.closed:
+                    self.error = f"Inference worker {self.index} exited with code {code} before it was ready"
+                self.ready.clear()
+            pending, self.pending = self.pending, {}
+        for waiter in pending.values():
+            waiter.event.set()
+
+    def call(self, op, key, frame=None):
+        # Returns the (33, 4) landmarks of a PROCESS request, None when nobody was found or for other ops.
+        # Raises WorkerCrashed when the worker died or hung with the request.
+        if self.closed:
+            raise WorkerCrashed("Inference worker is closed")
+        slot = self.free.get()
+        try:
+            height, width = frame.shape[:2] if frame is not None else (0, 0)
+            if frame is not None:
+                np.copyto(self.ring[slot, FRAME_OFFSET:FRAME_OFFSET + frame.size].reshape(frame.shape), frame)
+            waiter = _Waiter()
+            with self.lock:
+                if self.process is None:
+                    if self.error or self.closed:
+                        raise WorkerCrashed(self.error or "Inference worker is closed")
+                    self._start()
+                self.pending[slot] = waiter
+                try:
+                    self.process.stdin.write(REQUEST.pack(op, slot, height, width, key))
+                    self.process.stdin.flush()
+                except OSError:
+                    pass  # the reader sees the worker go and wakes us
+            if not waiter.event.wait(self.timeout):
+                self._kill()
+                waiter.event.wait()
+            if waiter.status is None:
+                raise WorkerCrashed(f"Inference worker {self.index} died")
+            if waiter.status == FAILED:
+                raise RuntimeError(f"Inference worker {self.index} failed on a frame, see its log")
+            if waiter.status == POSE:
+                return self.ring[slot, :RESULT_BYTES].view(np.float32).reshape(NUM_LANDMARKS, 4).copy()
+            return None
+        finally:
+            self.free.put(slot)
+
+    def _kill(self):
+        with self.lock:
+            process = self.process
+        if process:
+            process.kill()  # the reader thread then fails everything it had pending
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            process = self.process
+        if process:
+            process.stdin.close()  # the worker exits at end of input
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        del self.ring  # the mapping can't be closed while an array still points into it
+        self.memory.close()
+        self.memory.unlink()
+
+
+class RemotePose:
+    # Stand-in for a mediapipe Pose graph that lives in a worker process, all the tracker and session use
+    def __init__(self, worker, key):
+        self.worker = worker
+        self.key = key
+
+    def process(self, rgb_frame):
+        height, width = rgb_frame.shape[:2]
+        if height * width > self.worker.max_pixels:
+            scale = (self.worker.max_pixels / (height * width)) ** 0.5  # landmarks are normalised, size doesn't show
+            rgb_frame = cv2.resize(rgb_frame, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+        try:
+            points = self.worker.call(PROCESS, self.key, rgb_frame)
+        except WorkerCrashed:
+            points = None  # this frame is lost, the next one goes to the restarted worker
+        return PoseResult(points)
+
+    def reset(self):
+        try:
+            self.worker.call(RESET, self.key)
+        except WorkerCrashed:
+            pass  # a restarted worker starts the session from a fresh graph anyway
+
+
+class InferenceWorkerPool:
+    # Drop-in for PosePool that keeps the Pose graphs in worker processes instead of the web process, so
+    # inference for different sessions runs on different cores and a crash in the model only costs its worker.
+    # The web tier just routes: each session is pinned to the worker with the fewest sessions (its graph keeps
+    # tracking state between frames), and frames go back and forth through that worker's shared-memory ring.
+    # Rep rules and drawing stay in the web process, they need the session's state and the annotated frame.
+    def __init__(self, workers=2, size=32, prewarm=1, model_complexity=1, min_detection_confidence=0.5,
+                 min_tracking_confidence=0.5, slots=4, max_pixels=1280 * 720, timeout=30):
+        self.size = size
+        self.capacity = threading.Semaphore(size)
+        self.workers = [InferenceWorker(i, slots, max_pixels, prewarm, model_complexity, min_detection_confidence,
+                                        min_tracking_confidence, timeout) for i in range(workers)]
+        self.in_use = 0
+        self.next_key = 0
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        threading.Thread(target=self._wait_until_ready, daemon=True, name="inference-workers-ready").start()
+        atexit.register(self.close)
+
+    def _wait_until_ready(self):
+        # Ready once every worker has either come up or failed, as long as one came up
+        for worker in self.workers:
+            while not worker.ready.wait(0.5):
+                if worker.error:
+                    break
+        if not self.error:
+            self.ready.set()
+
+    @property
+    def error(self):
+        # Only set when no worker is left to route sessions to, a pool with one healthy worker still serves
+        errors = [worker.error for worker in self.workers if worker.error]
+        return "; ".join(errors) if len(errors) == len(self.workers) else None
+
+    def acquire(self, timeout=5):
+        if not self.capacity.acquire(timeout=timeout):
+            raise PoolExhausted(f"All {self.size} pose graphs are in use")
+        with self.lock:
+            worker = min((w for w in self.workers if not w.error), key=lambda w: w.sessions, default=None)
+            if worker is None:
+                self.capacity.release()
+                raise PoolExhausted(f"No inference worker is running: {self.error}")
+            worker.sessions += 1
+            self.in_use += 1
+            self.next_key += 1
+            return RemotePose(worker, self.next_key)
+
+    def release(self, pose):
+        try:
+            pose.worker.call(RELEASE, pose.key)  # the worker resets the graph and keeps it for the next session
+        except WorkerCrashed:
+            pass
+        with self.lock:
+            pose.worker.sessions -= 1
+            self.in_use -= 1
+        self.capacity.release()
+
+    def available(self):
+        return self.size - self.in_use
+
+    def close(self):
+        for worker in self.workers:
+            if not worker.closed:
+                worker.close()
+
+
+def serve(name, slots, slot_bytes, prewarm, model_complexity, min_detection_confidence, min_tracking_confidence):
+    # Worker process main loop: one Pose graph per session routed here, answered strictly in request order
+    import mediapipe as mp
+    answers = os.fdopen(os.dup(1), "wb", buffering=0)
+    os.dup2(2, 1)  # anything else printed goes to the log, not into the protocol
+    requests = sys.stdin.buffer
+    memory = shared_memory.SharedMemory(name)
+    resource_tracker.unregister(memory._name, "shared_memory")  # the web process owns it and unlinks it
+    ring = np.ndarray((slots, slot_bytes), np.uint8, memory.buf)
+
+    def create():
+        pose = mp.solutions.pose.Pose(model_complexity=model_complexity,
+                                      min_detection_confidence=min_detection_confidence,
+                                      min_tracking_confidence=min_tracking_confidence)
+        pose.process(np.zeros((256, 256, 3), dtype=np.uint8))  # load the model now, see PosePool._create
+        pose.reset()
+        return pose
+
+    idle = [create() for _ in range(prewarm)]
+    poses = {}  # session key -> graph
+    answers.write(RESPONSE.pack(READY_SLOT, READY))
+    while True:
+        message = requests.read(REQUEST.size)
+        if len(message) < REQUEST.size:
+            break  # pipe closed: the pool was closed or the web process went away
+        op, slot, height, width, key = REQUEST.unpack(message)
+        status = NO_POSE
+        try:
+            if op == PROCESS:
+                pose = poses.get(key)
+                if pose is None:
+                    pose = poses[key] = idle.pop() if idle else create()
+                frame = ring[slot, FRAME_OFFSET:FRAME_OFFSET + height * width * 3].reshape(height, width, 3)
+                result = pose.process(frame)
+                if result.pose_landmarks:
+                    points = ring[slot, :RESULT_BYTES].view(np.float32).reshape(NUM_LANDMARKS, 4)
+                    points[:] = landmarks_to_array(result.pose_landmarks.landmark)
+                    status = POSE
+            elif op == RESET and key in poses:
+                poses[key].reset()
+            elif op == RELEASE and key in poses:
+                pose = poses.pop(key)
+                pose.reset()
+                idle.append(pose)
+        except Exception:
+            traceback.print_exc()
+            status = FAILED
+        answers.write(RESPONSE.pack(slot, status))
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4]), int(sys.argv[5]),
+          float(sys.argv[6]), float(sys.argv[7]))
@@ -0,0 +1,127 @@
+import struct
+
+import numpy as np
+
+# MediaPipe PoseLandmark indices, hard-coded so this module only needs numpy
+LANDMARK_INDEX = {
+    "NOSE": 0,
+    "LEFT_SHOULDER": 11, "RIGHT_SHOULDER": 12,
+    "LEFT_ELBOW": 13, "RIGHT_ELBOW": 14,
+    "LEFT_WRIST": 15, "RIGHT_WRIST": 16,
+    "LEFT_HIP": 23, "RIGHT_HIP": 24,
+    "LEFT_KNEE": 25, "RIGHT_KNEE": 26,
+    "LEFT_ANKLE": 27, "RIGHT_ANKLE": 28,
+}
+NUM_LANDMARKS = 33
+
+# (name, first point, vertex, second point) for every joint angle the exercises use
+ANGLE_TABLE = [
+    ("left_elbow", "LEFT_SHOULDER", "LEFT_ELBOW", "LEFT_WRIST"),
+    ("right_elbow", "RIGHT_SHOULDER", "RIGHT_ELBOW", "RIGHT_WRIST"),
+    ("left_shoulder", "LEFT_HIP", "LEFT_SHOULDER", "LEFT_ELBOW"),
+    ("right_shoulder", "RIGHT_HIP", "RIGHT_SHOULDER", "RIGHT_ELBOW"),
+    ("left_hip_angle", "LEFT_KNEE", "LEFT_HIP", "LEFT_SHOULDER"),
+    ("right_hip_angle", "RIGHT_KNEE", "RIGHT_HIP", "RIGHT_SHOULDER"),
+    ("right_pull_up_angle", "RIGHT_ELBOW", "RIGHT_SHOULDER", "LEFT_SHOULDER"),
+]
+ANGLE_NAMES = [row[0] for row in ANGLE_TABLE]
+ANGLE_INDEX = {name: i for i, name in enumerate(ANGLE_NAMES)}
+ANGLE_A = np.array([LANDMARK_INDEX[row[1]] for row in ANGLE_TABLE])
+ANGLE_V = np.array([LANDMARK_INDEX[row[2]] for row in ANGLE_TABLE])
+ANGLE_B = np.array([LANDMARK_INDEX[row[3]] for row in ANGLE_TABLE])
+
+
+def landmarks_to_array(landmarks):
+    # (33, 4) float32 of x, y, z, visibility; accepts MediaPipe landmarks or an existing array
+    if isinstance(landmarks, np.ndarray):
+        return landmarks
+    return np.array([(lm.x, lm.y, lm.z, lm.visibility) for lm in landmarks], dtype=np.float32)
+
+
+def array_to_landmark_list(points):
+    # Inverse of landmarks_to_array, for stored landmarks that have to go through mp drawing utils again
+    from mediapipe.framework.formats import landmark_pb2
+    return landmark_pb2.NormalizedLandmarkList(landmark=[
+        landmark_pb2.NormalizedLandmark(x=x, y=y, z=z, visibility=v) for x, y, z, v in points.tolist()])
+
+
+class PoseResult:
+    # Minimal stand-in for a pose.process() result built from stored landmarks
+    __slots__ = ("pose_landmarks",)
+
+    def __init__(self, points):
+        self.pose_landmarks = None if points is None or np.isnan(points).any() else array_to_landmark_list(points)
+
+
+def compute_angles(points):
+    # Works on a single frame (33, 4) or any batch (..., 33, 4), angles use x/y only like the original tracker.
+    # Done in float64 because arccos near 0/180 degrees amplifies float32 rounding.
+    xy = points[..., :2]
+    vertex = xy[..., ANGLE_V, :].astype(np.float64)
+    av = xy[..., ANGLE_A, :] - vertex
+    bv = xy[..., ANGLE_B, :] - vertex
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cosine = (av * bv).sum(axis=-1) / (np.linalg.norm(av, axis=-1) * np.linalg.norm(bv, axis=-1))
+    return np.degrees(np.arccos(np.clip(cosine, -1.0, 1.0)))
+
+
+class Angles:
+    # Array-backed stand-in for the old angles dict, angles['left_elbow'] still works
+    __slots__ = ("values",)
+
+    def __init__(self, values):
+        self.values = values
+
+    def __getitem__(self, name):
+        return self.values[ANGLE_INDEX[name]]
+
+    def __contains__(self, name):
+        return name in ANGLE_INDEX
+
+    def keys(self):
+        return list(ANGLE_NAMES)
+
+    def as_dict(self):
+        return dict(zip(ANGLE_NAMES, self.values.tolist()))
+
+
+class Keypoints:
+    # Array-backed stand-in for the old keypoints dict, keypoints["LEFT_WRIST"][1] still works
+    __slots__ = ("points",)
+
+    def __init__(self, points):
+        self.points = points
+
+    def __getitem__(self, name):
+        return self.points[LANDMARK_INDEX[name], :2]
+
+    def __contains__(self, name):
+        return name in LANDMARK_INDEX
+
+    def visibility(self, indices):
+        return self.points[indices, 3]
+
+
+def angles_and_keypoints(landmarks):
+    points = landmarks_to_array(landmarks)
+    return Angles(compute_angles(points)), Keypoints(points)
+
+
+# Binary frame for landmark-only streams: timestamp, reps, posture_ok, has_landmarks, then 33x4 float16
+PACKED_HEADER = struct.Struct("<dIBB")
+
+
+def pack_landmarks(points, timestamp, reps, posture_ok):
+    # ~280 bytes per frame versus tens of KB for an annotated JPEG
+    header = PACKED_HEADER.pack(timestamp, reps, int(posture_ok), points is not None)
+    if points is None:
+        return header
+    return header + points.astype("<f2").tobytes()
+
+
+def unpack_landmarks(data):
+    timestamp, reps, posture_ok, has_landmarks = PACKED_HEADER.unpack_from(data)
+    points = None
+    if has_landmarks:
+        points = np.frombuffer(data, dtype="<f2", offset=PACKED_HEADER.size).reshape(NUM_LANDMARKS, 4)
+    return timestamp, reps, bool(posture_ok), points
@@ -0,0 +1,130 @@
+import bisect
+import collections
+import threading
+import time
+
+# Upper bounds (seconds) of the per-stage latency buckets, the last bucket is +Inf
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class StageHistogram:
+    # Cumulative Prometheus buckets plus a ring of the most recent samples, so quantiles follow the
+    # current load instead of being averaged over the whole process lifetime
+    def __init__(self, buckets=STAGE_BUCKETS, window=1024):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.recent = collections.deque(maxlen=window)
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+        self.recent.append(seconds)
+
+    def quantiles(self):
+        recent = sorted(self.recent)
+        if not recent:
+            return {}
+        return {q: recent[min(len(recent) - 1, int(q * len(recent)))] for q in QUANTILES}
+
+
+class RateMeter:
+    # Events per second over the last `window` seconds
+    def __init__(self, window=5.0):
+        self.window = window
+        self.times = collections.deque()
+
+    def tick(self, now=None):
+        now = time.monotonic() if now is None else now
+        self.times.append(now)
+        self._trim(now)
+
+    def rate(self, now=None):
+        now = time.monotonic() if now is None else now
+        self._trim(now)
+        return len(self.times) / self.window
+
+    def _trim(self, now):
+        while self.times and now - self.times[0] > self.window:
+            self.times.popleft()
+
+
+class Metrics:
+    # Hot-path instrumentation. Stages are timed as
+    #     start = metrics.start()
+    #     ...
+    #     metrics.observe("inference", start)
+    # and when disabled start() returns None and everything else returns straight away.
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.counters = collections.Counter()
+
+    def start(self):
+        return time.perf_counter() if self.enabled else None
+
+    def observe(self, stage, start):
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = StageHistogram()
+            histogram.observe(elapsed)
+
+    def count(self, name, value=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] += value
+
+    def render(self, sessions=(), gauges=None):
+        # Prometheus text exposition format
+        lines = []
+        with self.lock:
+            stages = {name: (list(h.counts), h.sum, h.count, h.quantiles()) for name, h in sorted(self.stages.items())}
+            counters = dict(self.counters)
+
+        lines.append("# HELP pose_stage_seconds Time spent in each per-frame stage")
+        lines.append("# TYPE pose_stage_seconds histogram")
+        for name, (counts, total, count, _) in stages.items():
+            cumulative = 0
+            for bound, n in zip(STAGE_BUCKETS + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'pose_stage_seconds_bucket{{stage="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'pose_stage_seconds_sum{{stage="{name}"}} {total:.6f}')
+            lines.append(f'pose_stage_seconds_count{{stage="{name}"}} {count}')
+
+        lines.append("# HELP pose_stage_recent_seconds Stage latency quantiles over the most recent frames")
+        lines.append("# TYPE pose_stage_recent_seconds summary")
+        for name, (_, _, _, quantiles) in stages.items():
+            for q, value in quantiles.items():
+                lines.append(f'pose_stage_recent_seconds{{stage="{name}",quantile="{q}"}} {value:.6f}')
+
+        for name in sorted(counters):
+            lines.append(f"# TYPE pose_{name}_total counter")
+            lines.append(f"pose_{name}_total {counters[name]}")
+
+        for name, (help_text, value) in sorted((gauges or {}).items()):
+            lines.append(f"# HELP pose_{name} {help_text}")
+            lines.append(f"# TYPE pose_{name} gauge")
+            lines.append(f"pose_{name} {value}")
+
+        lines.append("# HELP pose_session_fps Frames processed per second by each active session")
+        lines.append("# TYPE pose_session_fps gauge")
+        for s in sessions:
+            lines.append(f'pose_session_fps{{session="{s.session_id[:8]}"}} {s.fps.rate():.2f}')
+        lines.append("# HELP pose_session_dropped_frames Frames each active session dropped to keep up")
+        lines.append("# TYPE pose_session_dropped_frames gauge")
+        for s in sessions:
+            lines.append(f'pose_session_dropped_frames{{session="{s.session_id[:8]}"}} {s.dropped_frames}')
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide instance, off by default so batch jobs and benchmarks don't pay for it; api.py turns it on
+metrics = Metrics()
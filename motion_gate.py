@@ -0,0 +1,46 @@
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    # Skips pose.process on frames that look the same as the last one it ran on, for the still stretches of a
+    # workout (a plank hold, rest between sets) where the model would only return the landmarks it already has.
+    # Frames are compared as small greyscale thumbnails against the one from the last inference, not the
+    # previous frame, so slow movement builds up until it triggers. Counting changed pixels rather than averaging
+    # the difference ignores sensor noise but still catches a limb moving in an otherwise still frame.
+    # Skipped frames reuse the last landmarks and still go through count_reps with their own timestamp, so timed
+    # holds keep running; every refresh_every-th frame runs the model regardless.
+    def __init__(self, width=80, pixel_threshold=12, max_changed=0.004, refresh_every=6):
+        self.width = width                        # thumbnail width in pixels
+        self.pixel_threshold = pixel_threshold    # grey levels a pixel must change by to count as moved
+        self.max_changed = max_changed            # fraction of moved pixels below which a frame counts as still
+        self.refresh_every = refresh_every
+        self.reference = None  # thumbnail of the frame inference last ran on
+        self.thumbnail = None
+        self.points = None     # its landmarks, (33, 4) float32 or None
+        self.skipped = 0       # frames reused since then
+
+    def reset(self):
+        self.reference = None
+        self.points = None
+        self.skipped = 0
+
+    def still(self, frame):
+        # True when frame can reuse the last landmarks. Otherwise the caller runs the model and passes the result
+        # to update(), which makes this frame the new reference.
+        height, width = frame.shape[:2]
+        small = cv2.resize(frame, (self.width, max(1, round(height * self.width / width))), interpolation=cv2.INTER_AREA)
+        self.thumbnail = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        if self.reference is None or self.reference.shape != self.thumbnail.shape or self.skipped + 1 >= self.refresh_every:
+            return False
+        changed = np.count_nonzero(cv2.absdiff(self.thumbnail, self.reference) > self.pixel_threshold)
+        if changed > self.max_changed * self.thumbnail.size:
+            return False
+        self.skipped += 1
+        return True
+
+    def update(self, points):
+        # Landmarks the model returned for the frame still() was last asked about
+        self.reference = self.thumbnail
+        self.points = None if points is None else points.copy()
+        self.skipped = 0
@@ -0,0 +1,195 @@
+import os
+import time
+
+import cv2
+import mediapipe as mp
+import numpy as np
+
+from landmarks import LANDMARK_INDEX, NUM_LANDMARKS, PoseResult
+from mvp import ExerciseTracker
+
+# Shoulders and hips: the most stable landmarks for telling people apart between frames
+TORSO = np.array([LANDMARK_INDEX[name] for name in ("LEFT_SHOULDER", "RIGHT_SHOULDER", "LEFT_HIP", "RIGHT_HIP")])
+
+
+class MultiPoseDetector:
+    # MediaPipe Tasks PoseLandmarker in video mode: one graph call per frame finds every body (one detector pass,
+    # then the landmark model over all the people found) instead of a legacy Pose graph per person.
+    # Needs a pose_landmarker_*.task model bundle, the legacy solution doesn't ship one.
+    def __init__(self, model_path, num_poses=4, min_detection_confidence=0.5, min_tracking_confidence=0.5):
+        from mediapipe.tasks.python import BaseOptions
+        from mediapipe.tasks.python import vision
+        if not os.path.isfile(model_path):
+            raise ValueError(f"Pose landmarker model not found: {model_path}")
+        options = vision.PoseLandmarkerOptions(
+            base_options=BaseOptions(model_asset_path=model_path),
+            running_mode=vision.RunningMode.VIDEO,
+            num_poses=num_poses,
+            min_pose_detection_confidence=min_detection_confidence,
+            min_pose_presence_confidence=min_detection_confidence,
+            min_tracking_confidence=min_tracking_confidence)
+        self.landmarker = vision.PoseLandmarker.create_from_options(options)
+        self.last_ms = -1
+
+    def detect(self, rgb_frame, timestamp):
+        # Returns (people, 33, 4) float32 of x, y, z, visibility
+        timestamp_ms = max(self.last_ms + 1, int(timestamp * 1000))  # video mode needs strictly increasing times
+        self.last_ms = timestamp_ms
+        image = mp.Image(image_format=mp.ImageFormat.SRGB, data=np.ascontiguousarray(rgb_frame))
+        result = self.landmarker.detect_for_video(image, timestamp_ms)
+        if not result.pose_landmarks:
+            return np.zeros((0, NUM_LANDMARKS, 4), dtype=np.float32)
+        return np.array([[(lm.x, lm.y, lm.z, lm.visibility) for lm in person] for person in result.pose_landmarks],
+                        dtype=np.float32)
+
+    def close(self):
+        self.landmarker.close()
+
+
+class TrackAssigner:
+    # Stable ids across frames: each detection goes to the nearest live track (mean torso distance in
+    # normalised coordinates), closest pairs first. Unmatched detections start new tracks and tracks unseen
+    # for max_missed frames are retired.
+    def __init__(self, max_distance=0.15, max_missed=15):
+        self.max_distance = max_distance
+        self.max_missed = max_missed
+        self.tracks = {}  # id -> {"torso": (4, 2), "missed": frames}
+        self.next_id = 1
+
+    def assign(self, people):
+        # Returns (track id per detection, ids retired this frame)
+        torsos = people[:, TORSO, :2] if len(people) else np.zeros((0, len(TORSO), 2))
+        ids = list(self.tracks)
+        assigned = [None] * len(people)
+        if ids and len(people):
+            known = np.array([self.tracks[i]["torso"] for i in ids])
+            distance = np.linalg.norm(torsos[:, None] - known[None], axis=-1).mean(axis=-1)  # (detections, tracks)
+            used_tracks = set()
+            for flat in np.argsort(distance, axis=None):
+                d, t = divmod(int(flat), len(ids))
+                if distance[d, t] > self.max_distance:
+                    break
+                if assigned[d] is None and t not in used_tracks:
+                    assigned[d] = ids[t]
+                    used_tracks.add(t)
+
+        for d, track_id in enumerate(assigned):
+            if track_id is None:
+                track_id = assigned[d] = self.next_id
+                self.next_id += 1
+                self.tracks[track_id] = {}
+            self.tracks[track_id].update(torso=torsos[d], missed=0)
+
+        retired = []
+        for track_id in list(self.tracks):
+            if track_id not in assigned:
+                self.tracks[track_id]["missed"] += 1
+                if self.tracks[track_id]["missed"] > self.max_missed:
+                    del self.tracks[track_id]
+                    retired.append(track_id)
+        return assigned, retired
+
+
+class MultiPersonTracker:
+    # One ExerciseTracker (smoothing, posture, rep state machine) per tracked person, fed from a single
+    # MultiPoseDetector call per frame. Exposes the totals ExerciseTracker does, so sessions and
+    # /stop_exercise work unchanged.
+    multi = True
+
+    def __init__(self, exercise_id, detector):
+        self.exercise_id = exercise_id
+        self.detector = detector
+        self.pose = None  # no pooled legacy graph
+        self.assigner = TrackAssigner()
+        self.people = {}   # track id -> ExerciseTracker
+        self.retired = []  # trackers of people who left, their reps still count towards the session
+        self.latest = {}   # track id -> landmarks in the last frame
+        self.template = self._new_tracker()
+        self.exercise_type = self.template.exercise_type
+        self.rules = self.template.rules
+
+    def _new_tracker(self):
+        return ExerciseTracker(exercise_id=self.exercise_id, pose=self.detector)  # never calls pose.process
+
+    def _all(self):
+        return list(self.people.values()) + self.retired
+
+    @property
+    def rep_count(self):
+        return sum(t.rep_count for t in self._all())
+
+    @property
+    def calories_burned(self):
+        return sum(t.calories_burned for t in self._all())
+
+    @property
+    def exercise_duration(self):
+        return max((t.exercise_duration for t in self._all()), default=0)
+
+    @property
+    def posture_ok(self):
+        return all(self.people[i].posture_ok for i in self.latest)
+
+    @property
+    def exercise_state(self):
+        return ""
+
+    def new_source(self):
+        # Everyone tracked so far is retired with their reps, the new source's people start new tracks
+        self.retired.extend(self.people.values())
+        self.people = {}
+        self.latest = {}
+        self.assigner = TrackAssigner(self.assigner.max_distance, self.assigner.max_missed)
+
+    def process(self, rgb_frame, frame, timestamp):
+        # Detect, match to tracks, run each person's rules; draws onto frame unless it's None.
+        # Returns a PoseResult for the first tracked person (or none) for callers that expect one body.
+        timestamp = time.time() if timestamp is None else timestamp
+        people = self.detector.detect(rgb_frame, timestamp)
+        assigned, retired = self.assigner.assign(people)
+        for track_id in retired:
+            self.retired.append(self.people.pop(track_id))
+        self.latest = {}
+        for points, track_id in zip(people, assigned):
+            tracker = self.people.get(track_id)
+            if tracker is None:
+                tracker = self.people[track_id] = self._new_tracker()
+            angles, keypoints = tracker.get_angles_from_landmarks(points, timestamp)
+            tracker.count_reps(None, angles, None, points, keypoints, timestamp)
+            self.latest[track_id] = points
+            if frame is not None:
+                self._draw(frame, track_id, tracker, points)
+        return PoseResult(people[0] if len(people) else None)
+
+    def _draw(self, frame, track_id, tracker, points):
+        # count_reps' own overlay assumes one person at fixed positions, so label each body next to its head
+        result = PoseResult(points)
+        mp.solutions.drawing_utils.draw_landmarks(frame, result.pose_landmarks, mp.solutions.pose.POSE_CONNECTIONS)
+        height, width = frame.shape[:2]
+        visible = points[points[:, 3] > 0.5]
+        if not len(visible):
+            return
+        x = int(np.clip(visible[:, 0].min(), 0, 1) * width)
+        y = int(np.clip(visible[:, 1].min(), 0, 1) * height)
+        color = (0, 255, 0) if tracker.posture_ok else (0, 0, 255)
+        count = f"{tracker.elapsed_time}s" if tracker.rules.timer_state else f"{tracker.rep_count} reps"
+        cv2.putText(frame, f"#{track_id} {count}", (x, max(20, y - 10)), cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2, cv2.LINE_AA)
+
+    def status(self):
+        people = []
+        for track_id, tracker in self.people.items():
+            state = tracker.status()
+            state["track_id"] = track_id
+            points = self.latest.get(track_id)
+            state["landmarks"] = points.round(4).tolist() if points is not None else None
+            people.append(state)
+        return {
+            "exercise": self.exercise_type,
+            "reps": self.rep_count,
+            "duration": round(self.exercise_duration, 2),
+            "calories": round(self.calories_burned, 2),
+            "people": people,
+        }
+
+    def close(self):
+        self.detector.close()
@@ -0,0 +1,88 @@
+import hashlib
+import os
+import threading
+import uuid
+
+import numpy as np
+
+from landmarks import NUM_LANDMARKS
+
+
+class PoseCache:
+    # Per-frame landmarks of already analysed clips, keyed by a hash of the file contents so re-uploading
+    # the same workout (under any name) skips pose inference and only replays the rep logic.
+    # Each entry is one .npz with "points" (frames, 33, 4) float16, NaN rows for frames with nobody detected,
+    # and "timestamps" (frames,). Least recently used entries are evicted once the directory exceeds max_bytes.
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key_for_file(path, variant=""):
+        # variant covers whatever else changes the landmarks for the same bytes (model complexity, input size)
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest() + ("-" + variant if variant else "")
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def get(self, key):
+        # Returns (points float32, timestamps) or None
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                points, timestamps = data["points"].astype(np.float32), data["timestamps"]
+            os.utime(path)  # mtime doubles as the LRU clock
+        except (OSError, KeyError, ValueError):
+            return None
+        return points, timestamps
+
+    def put(self, key, points, timestamps):
+        points = np.asarray(points, dtype=np.float16).reshape(-1, NUM_LANDMARKS, 4)
+        # Write under a temporary name first so a concurrent get() never sees half a file
+        tmp = os.path.join(self.directory, f".{uuid.uuid4().hex}.tmp.npz")
+        np.savez(tmp, points=points, timestamps=np.asarray(timestamps, dtype=np.float64))
+        os.replace(tmp, self._path(key))
+        self.evict()
+
+    def evict(self):
+        with self.lock:
+            entries = []
+            for name in os.listdir(self.directory):
+                if not name.endswith(".npz") or name.startswith("."):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+                total -= size
+
+
+class LandmarkRecorder:
+    # Collects one landmark row per processed frame of a clip so a finished pass can be stored in a PoseCache
+    def __init__(self):
+        self.points = []
+        self.timestamps = []
+
+    def add(self, points, timestamp):
+        if points is None:
+            points = np.full((NUM_LANDMARKS, 4), np.nan)
+        self.points.append(points.astype(np.float16))  # stored as float16 anyway, half the memory while recording
+        self.timestamps.append(timestamp or 0.0)
+
+    def __len__(self):
+        return len(self.points)
@@ -0,0 +1,92 @@
+import queue
+import threading
+
+import numpy as np
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class PosePool:
+    # Bounded pool of MediaPipe Pose graphs so starting a session doesn't pay the model load every time.
+    # With background=True the prewarm (and the mediapipe import) runs on a thread so the app can start
+    # serving straight away; ready is set once at least one graph has been built.
+    def __init__(self, size=4, prewarm=None, model_complexity=1, min_detection_confidence=0.5, min_tracking_confidence=0.5,
+                 background=False):
+        self.size = size
+        self.model_complexity = model_complexity
+        self.min_detection_confidence = min_detection_confidence
+        self.min_tracking_confidence = min_tracking_confidence
+        self.idle = queue.LifoQueue()  # LIFO so the most recently used (hottest) graph goes out first
+        self.created = 0
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.error = None  # why the background warm-up failed, if it did
+        count = size if prewarm is None else prewarm
+        if background:
+            threading.Thread(target=self._warm_up_in_background, args=(count,), daemon=True, name="pose-warm-up").start()
+        else:
+            self.warm_up(count)
+            self.ready.set()
+
+    def _warm_up_in_background(self, count):
+        try:
+            self.warm_up(max(count, 1))  # at least one, so the model is known to load before we report ready
+            self.ready.set()
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+
+    def _create(self):
+        import mediapipe as mp  # deferred, see ExerciseTracker
+        pose = mp.solutions.pose.Pose(model_complexity=self.model_complexity,
+                                      min_detection_confidence=self.min_detection_confidence,
+                                      min_tracking_confidence=self.min_tracking_confidence)
+        # First process() call initialises the graph and loads the model, do it now instead of on a user's first frame
+        pose.process(np.zeros((256, 256, 3), dtype=np.uint8))
+        pose.reset()
+        return pose
+
+    def _reserve(self):
+        with self.lock:
+            if self.created >= self.size:
+                return False
+            self.created += 1
+            return True
+
+    def warm_up(self, count):
+        for _ in range(count):
+            if not self._reserve():
+                break
+            try:
+                pose = self._create()
+            except Exception:
+                with self.lock:
+                    self.created -= 1
+                raise
+            self.idle.put(pose)
+
+    def acquire(self, timeout=5):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        if self._reserve():
+            try:
+                return self._create()
+            except Exception:
+                with self.lock:
+                    self.created -= 1
+                raise
+        try:
+            return self.idle.get(timeout=timeout)
+        except queue.Empty:
+            raise PoolExhausted(f"All {self.size} pose graphs are in use")
+
+    def release(self, pose):
+        # Clear tracking state so the next session doesn't start from someone else's last landmarks
+        pose.reset()
+        self.idle.put(pose)
+
+    def available(self):
+        return self.idle.qsize() + (self.size - self.created)
@@ -0,0 +1,301 @@
+import argparse
+import copy
+import csv
+import itertools
+import json
+import os
+import time
+
+import numpy as np
+
+from archive import ARCHIVE_EXTENSION, read_archive
+from exercises import EXERCISE_SPECS, EXERCISES, ExerciseRules, load_exercise_specs
+from filters import one_euro_batch
+from landmarks import LANDMARK_INDEX, NUM_LANDMARKS, compute_angles
+
+# Replays stored landmark sequences (session archives or pose cache entries) through the rep/posture rules
+# without touching video or the pose model, to see what a threshold change would have counted.
+#
+#   python rescore.py session_archive/ --out rescored.csv
+#   python rescore.py session_archive/ --set "states.0.angles.{side}_elbow.1=100,110,120" --set min_rep_time=0.2,0.4
+#
+# Everything per frame (smoothing, angles, posture, state classification) runs as numpy over the time axis of
+# a whole batch of sessions; only the debounce/rep state machines step through runs of equal state.
+
+TRACKER_PARAMS = ("min_state_time", "min_rep_time", "min_cutoff", "beta")
+DEFAULT_PARAMS = {"min_state_time": 0.1, "min_rep_time": 0.2, "min_cutoff": 1.0, "beta": 5.0}
+# The filter is element-wise, so smoothing just the landmarks the rules read gives the same values for those
+RULE_LANDMARKS = np.array(sorted(set(LANDMARK_INDEX.values())))
+
+
+def load_sequence(path, exercise=None):
+    # {"name", "exercise", "points" (frames, 33, 4) float32, "timestamps"} from an archive (.ptla) or cache (.npz).
+    # Nothing is read up front: archive columns stay views of the memmap, and a cache entry's points (None here)
+    # are loaded when its batch is prepared, so a run over thousands of sessions holds one batch at a time.
+    if path.endswith(ARCHIVE_EXTENSION):
+        header, frames = read_archive(path)
+        return {"name": path, "exercise": exercise or header["exercise"],
+                "points": frames["points"], "timestamps": frames["timestamp"]}
+    with np.load(path) as data:
+        return {"name": path, "exercise": exercise, "points": None, "timestamps": data["timestamps"]}
+
+
+def sequence_points(sequence):
+    if sequence["points"] is not None:
+        return sequence["points"]
+    with np.load(sequence["name"]) as data:
+        return data["points"].astype(np.float32)
+
+
+def collect_sequences(inputs, exercise=None):
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(os.path.join(item, name) for name in sorted(os.listdir(item))
+                         if name.endswith((ARCHIVE_EXTENSION, ".npz")))
+        else:
+            paths.append(item)
+    sequences = [load_sequence(path, exercise) for path in paths]
+    missing = [s["name"] for s in sequences if s["exercise"] is None]
+    if missing:
+        raise ValueError(f"no exercise known for {', '.join(missing)}, pass --exercise")
+    return sequences
+
+
+def stack(sequences):
+    # Pad to (sessions, frames, ...) with NaN rows, which count as frames where nobody was detected
+    frames = max(len(s["timestamps"]) for s in sequences)
+    points = np.full((len(sequences), frames, NUM_LANDMARKS, 4), np.nan, dtype=np.float32)
+    timestamps = np.zeros((len(sequences), frames))
+    for i, s in enumerate(sequences):
+        sequence = sequence_points(s)
+        points[i, :len(sequence)] = sequence
+        timestamps[i, :len(s["timestamps"])] = s["timestamps"]
+    valid = ~np.isnan(points).any(axis=(-2, -1))
+    return points, timestamps, valid
+
+
+def prepare(sequences, min_cutoff=1.0, beta=5.0, smoothing=True):
+    # The expensive, threshold-independent part: smoothing and joint angles for a batch of sessions
+    points, timestamps, valid = stack(sequences)
+    if smoothing:
+        points[:, :, RULE_LANDMARKS] = one_euro_batch(points[:, :, RULE_LANDMARKS], timestamps, valid,
+                                                      min_cutoff=min_cutoff, beta=beta)
+    return {"points": points, "timestamps": timestamps, "valid": valid, "angles": compute_angles(points)}
+
+
+def run_state_machines(rules, states, times, min_state_time, min_rep_time):
+    # ExerciseTracker.count_reps for one session, given the classified state code and time of every frame that
+    # passed the posture check. Works on runs of equal state instead of frame by frame.
+    result = {"reps": 0, "duration": 0.0, "shaky_frames": 0}
+    if not len(states):
+        return result
+    names = rules.state_names
+    starts = np.flatnonzero(np.r_[True, states[1:] != states[:-1]])
+    ends = np.r_[starts[1:], len(states)]
+    # First frame of each run that has been held for min_state_time, via searchsorted and then nudged by one
+    # so the comparison is exactly the debouncer's t - since >= min_hold
+    since = times[starts]
+    held = np.clip(np.searchsorted(times, since + min_state_time), starts, ends)
+    before = np.maximum(held - 1, 0)
+    held = np.where((held > starts) & (times[before] - since >= min_state_time), before, held)
+    at = np.minimum(held, len(times) - 1)
+    held = np.where((held < ends) & (times[at] - since < min_state_time), held + 1, held)
+
+    # StateDebouncer: accepted state per frame. A new run always restarts the candidate, so its hold
+    # starts at the run's first frame.
+    accepted = np.empty(len(states), dtype=np.uint8)
+    current, candidate, rejected = 0, None, 0  # state code 0 is "", the tracker's initial state
+    for start, end, switch in zip(starts.tolist(), ends.tolist(), held.tolist()):
+        code = states[start]
+        if code == current:
+            if candidate is not None:
+                rejected += 1
+            candidate = None
+            accepted[start:end] = current
+            continue
+        if candidate is not None:
+            rejected += 1
+        candidate = code
+        accepted[start:min(switch, end)] = current
+        if switch < end:
+            current, candidate = code, None
+            accepted[switch:end] = current
+    result["shaky_frames"] = rejected
+
+    # Rep state machine / timed hold over runs of equal accepted state
+    seg_starts = np.flatnonzero(np.r_[True, accepted[1:] != accepted[:-1]])
+    seg_ends = np.r_[seg_starts[1:], len(accepted)]
+    timer = rules.timer_state
+    seconds = times.tolist()
+    armed, reps, last_rep, elapsed = False, 0, None, 0
+    for start, end in zip(seg_starts.tolist(), seg_ends.tolist()):
+        state = names[accepted[start]]
+        if timer:
+            if state == timer:
+                elapsed = int(seconds[end - 1] - seconds[start])
+            continue
+        for i in range(start, end):
+            new_armed, count = rules.step(state, armed)
+            if count and last_rep is not None and seconds[i] - last_rep < min_rep_time:
+                count = 0
+            if count:
+                reps += count
+                last_rep = seconds[i]
+            if new_armed == armed and not count:
+                break  # nothing else can happen until the state changes
+            armed = new_armed
+    result["reps"] = elapsed if timer else reps
+    result["duration"] = float(times[-1] - times[0])
+    return result
+
+
+def rescore(sequences, exercise, spec=None, params=None, prepared=None):
+    # Rep counts for every sequence under one spec/parameter set. Pass prepared (from prepare()) to reuse
+    # smoothing and angles across parameter sets that only change thresholds.
+    params = dict(DEFAULT_PARAMS, **(params or {}))
+    rules = ExerciseRules(exercise, spec or EXERCISE_SPECS[exercise])
+    if prepared is None:
+        prepared = prepare(sequences, params["min_cutoff"], params["beta"])
+    points, angles, timestamps = prepared["points"], prepared["angles"], prepared["timestamps"]
+    ok = prepared["valid"] & rules.check_posture_batch(angles, points)
+    states = rules.classify_batch(angles)
+    rows = []
+    for i, sequence in enumerate(sequences):
+        mask = ok[i]
+        result = run_state_machines(rules, states[i][mask], timestamps[i][mask],
+                                    params["min_state_time"], params["min_rep_time"])
+        result.update(name=sequence["name"], exercise=exercise, frames=len(sequence["timestamps"]),
+                      calories=round(rules.calories_per_minute * result["duration"] / 60, 2),
+                      duration=round(result["duration"], 2))
+        rows.append(result)
+    return rows
+
+
+def set_path(spec, path, value):
+    # "states.0.angles.{side}_elbow.1" -> spec["states"][0]["angles"]["{side}_elbow"][1] = value
+    keys = path.split(".")
+    target = spec
+    for key in keys[:-1]:
+        target = target[int(key)] if isinstance(target, list) else target[key]
+    last = keys[-1]
+    if isinstance(target, list):
+        target[int(last)] = value
+    else:
+        target[last] = value
+
+
+def parse_settings(settings):
+    # ["path=v1,v2", ...] -> [(path, [v1, v2]), ...], values parsed as JSON so null/true/numbers work
+    parsed = []
+    for setting in settings:
+        path, _, values = setting.partition("=")
+        parsed.append((path.strip(), [json.loads(v) for v in values.split(",")]))
+    return parsed
+
+
+def sweep(sequences, exercise, settings, expected=None, chunk=64):
+    # Every combination of the --set values. Runs a chunk of sequences at a time through all of them, so only that
+    # chunk's landmarks and its smoothing/angles (once per filter setting) are in memory at any point.
+    combos = []
+    for values in itertools.product(*[v for _, v in settings]):
+        spec = copy.deepcopy(EXERCISE_SPECS[exercise])
+        params = {}
+        for (path, _), value in zip(settings, values):
+            if path in TRACKER_PARAMS:
+                params[path] = value
+            else:
+                set_path(spec, path, value)
+        combos.append((dict(zip([p for p, _ in settings], values)), spec, params))
+
+    combo_rows = [[] for _ in combos]
+    for offset in range(0, len(sequences), chunk):
+        batch = sequences[offset:offset + chunk]
+        prepared = {}  # (min_cutoff, beta) -> prepare() output, dropped with the chunk
+        for (label, spec, params), rows in zip(combos, combo_rows):
+            merged = dict(DEFAULT_PARAMS, **params)
+            key = (merged["min_cutoff"], merged["beta"])
+            if key not in prepared:
+                prepared[key] = prepare(batch, merged["min_cutoff"], merged["beta"])
+            rows.extend(rescore(batch, exercise, spec, params, prepared[key]))
+
+    results = []
+    for (label, _, _), rows in zip(combos, combo_rows):
+        summary = {"params": label, "total_reps": sum(r["reps"] for r in rows)}
+        if expected:
+            errors = [abs(r["reps"] - expected[r["name"]]) for r in rows if r["name"] in expected]
+            summary["mae"] = round(float(np.mean(errors)), 3) if errors else None
+        results.append((summary, rows))
+    return results
+
+
+def load_expected(path):
+    # CSV of "file,reps" ground truth for sweep scoring
+    expected = {}
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path) as f:
+        for row in csv.reader(f):
+            if len(row) < 2 or row[0].startswith("#"):
+                continue
+            name = row[0].strip()
+            expected[name if os.path.isabs(name) or os.path.exists(name) else os.path.join(base, name)] = int(row[1])
+    return expected
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-score recorded landmark sequences with new thresholds, no inference")
+    parser.add_argument("inputs", nargs="+", help="session archives (.ptla), pose cache entries (.npz) or directories")
+    parser.add_argument("--exercise", help="exercise name for sequences that don't record one (pose cache entries)")
+    parser.add_argument("--specs", help="JSON file with extra/overridden exercise specs (see exercises.py)")
+    parser.add_argument("--set", action="append", default=[], metavar="PATH=V1,V2",
+                        help="spec path or tracker parameter (" + ", ".join(TRACKER_PARAMS) + ") to sweep, repeatable")
+    parser.add_argument("--expected", help="CSV of 'file,reps' ground truth, adds mean absolute error to sweeps")
+    parser.add_argument("--out", help="write per-sequence results (.csv or .json)")
+    args = parser.parse_args()
+    if args.specs:
+        load_exercise_specs(args.specs)
+    if args.exercise and args.exercise.isdigit():
+        if int(args.exercise) >= len(EXERCISES):
+            parser.error(f"--exercise {args.exercise}: there are only {len(EXERCISES)} exercises")
+        args.exercise = EXERCISES[int(args.exercise)]
+    if args.exercise and args.exercise not in EXERCISE_SPECS:
+        parser.error(f"--exercise {args.exercise!r} is not one of {', '.join(EXERCISE_SPECS)}")
+
+    started = time.perf_counter()
+    try:
+        sequences = collect_sequences(args.inputs, args.exercise)
+    except ValueError as e:
+        parser.error(str(e))
+    unknown = sorted({s["exercise"] for s in sequences} - set(EXERCISE_SPECS))
+    if unknown:
+        parser.error(f"archives recorded unknown exercises {', '.join(unknown)}, pass --specs or --exercise")
+    settings = parse_settings(args.set)
+    expected = load_expected(args.expected) if args.expected else None
+    by_exercise = {}
+    for sequence in sequences:
+        by_exercise.setdefault(sequence["exercise"], []).append(sequence)
+
+    all_rows = []
+    for exercise, group in by_exercise.items():
+        for summary, rows in sweep(group, exercise, settings, expected):
+            print(exercise, json.dumps(summary))
+            for row in rows:
+                row["params"] = json.dumps(summary["params"])
+            all_rows.extend(rows)
+    frames = sum(len(s["timestamps"]) for s in sequences)
+    print(f"Re-scored {len(sequences)} sequences ({frames} frames) in {time.perf_counter() - started:.2f}s")
+
+    if args.out:
+        fields = ["name", "exercise", "params", "reps", "duration", "calories", "frames", "shaky_frames"]
+        if args.out.lower().endswith(".csv"):
+            with open(args.out, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+                writer.writeheader()
+                writer.writerows(all_rows)
+        else:
+            with open(args.out, "w") as f:
+                json.dump(all_rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
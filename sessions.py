@@ -0,0 +1,391 @@
+import os
+import threading
+import time
+
+import cv2
+
+from mvp import ExerciseTracker
+from exercises import EXERCISES
+from pose_pool import PoolExhausted
+from landmarks import landmarks_to_array, pack_landmarks, PoseResult
+from metrics import metrics, RateMeter
+from pose_cache import LandmarkRecorder
+from archive import ArchiveWriter, ARCHIVE_EXTENSION, evict_archives
+from motion_gate import MotionGate
+from frame_hub import FrameHub
+from buffers import ScratchBuffers
+
+
+class SessionLimitReached(Exception):
+    pass
+
+
+class SessionPipeline:
+    # Everything one browser session owns: its capture source and its ExerciseTracker (with its Pose graph)
+    def __init__(self, session_id, tracker, pose_pool=None, pose_cache=None, archive_path=None, motion_gate=False):
+        self.session_id = session_id
+        self.tracker = tracker
+        self.pose_pool = pose_pool
+        self.pose_cache = pose_cache
+        self.video_capture = None
+        self.live = False  # webcam sources are live, uploaded files are not
+        # Uploaded clips: either replay landmarks cached from an earlier pass, or record this pass for next time
+        self.cache_key = None
+        self.replay = None
+        self.recorder = None
+        self.frames_read = 0
+        self.eof = False
+        # Per-frame landmarks/angles/state go to an archive file (see archive.py), opened on the first frame
+        self.archive_path = archive_path
+        self.archive = None
+        # Reuse the last landmarks while the picture doesn't change (see motion_gate.py)
+        self.motion_gate = MotionGate() if motion_gate else None
+        self.multi = getattr(tracker, "multi", False)  # MultiPersonTracker: several bodies, one detector call
+        # Shared by every viewer of this session so they don't each run their own pipeline (see frame_hub.py)
+        self.hub = None
+        self.hub_lock = threading.Lock()
+        # Separate locks so the capture thread and the inference thread of a FramePipeline don't serialise
+        self.capture_lock = threading.Lock()
+        self.pose_lock = threading.Lock()
+        self.last_seen = time.time()
+        self.closed = False
+        self.fps = RateMeter()
+        # Capture and preprocessing write into the same arrays every frame instead of allocating new ones
+        self.raw_frame = None
+        self.buffers = ScratchBuffers()
+        self.dropped_frames = 0  # frames a FramePipeline discarded or skipped to keep a live feed current
+
+    def touch(self):
+        self.last_seen = time.time()
+
+    def frame_hub(self, **options):
+        # Created on first use, options only apply then
+        with self.hub_lock:
+            if self.hub is None:
+                self.hub = FrameHub(self, **options)
+            return self.hub
+
+    def count_dropped(self, n=1):
+        self.dropped_frames += n
+        metrics.count("dropped_frames", n)
+
+    def open_capture(self, source, cache_key=None):
+        # source: camera index, file path, or an already opened capture such as uploads.UploadCapture.
+        # cache_key may be a callable for uploads still arriving, whose content hash is only known at the end.
+        cached = self.pose_cache.get(cache_key) if self.pose_cache and cache_key and not callable(cache_key) else None
+        if cache_key and self.pose_cache and not callable(cache_key):
+            metrics.count("pose_cache_hits" if cached else "pose_cache_misses")
+        with self.hub_lock:
+            hub = self.hub
+        if hub:
+            hub.pause()
+        try:
+            self._open(source, cache_key, cached)
+        finally:
+            if hub:
+                hub.resume()
+        self.touch()
+
+    def _open(self, source, cache_key, cached):
+        self._interrupt_capture()
+        with self.capture_lock, self.pose_lock:
+            if self.video_capture:
+                self.video_capture.release()
+            self.video_capture = source if hasattr(source, "read") else cv2.VideoCapture(source)
+            self.live = isinstance(source, int)
+            if self.live:
+                # Don't let the driver queue up old frames, read() should return what the camera sees now
+                self.video_capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+            self.cache_key = cache_key
+            self.replay = cached[0] if cached else None
+            self.recorder = LandmarkRecorder() if cache_key and self.pose_cache and not cached else None
+            self.frames_read = 0
+            self.eof = False
+            self.tracker.new_source()
+            if self.motion_gate:
+                self.motion_gate.reset()
+
+    def _interrupt_capture(self):
+        # A capture over a file still being uploaded can block in read() waiting for data while holding
+        # capture_lock, tell it to give up first
+        capture = self.video_capture
+        if hasattr(capture, "stop"):
+            capture.stop()
+
+    def interrupt_read(self, thread):
+        # Wakes thread's read() blocked on an upload that is still arriving, like _interrupt_capture but the
+        # capture stays open, so a pipeline started after this one carries on from the same frame
+        capture = self.video_capture
+        if hasattr(capture, "interrupt"):
+            capture.interrupt(thread)
+
+    def read(self, size=None, dst=None):
+        # Reads under the lock so a concurrent open_capture/close can't release the handle mid-read.
+        # Also returns the frame time (wall clock for live cameras, stream position for files) and the frame's
+        # index in the source, which a cached clip's landmarks are looked up by.
+        # The frame is decoded into the same array every time, so with a size it's resized into dst before the
+        # lock is let go, where a second pipeline's read can't overwrite it halfway. Without one it's only
+        # valid until the next read().
+        with self.capture_lock:
+            if self.closed or not self.video_capture or not self.video_capture.isOpened():
+                return False, None, None, None
+            start = metrics.start()
+            success, frame = self.video_capture.read(self.raw_frame)
+            metrics.observe("capture", start)
+            timestamp = time.time() if self.live else self.video_capture.get(cv2.CAP_PROP_POS_MSEC) / 1000
+            index = self.frames_read
+            if success:
+                self.frames_read += 1
+                self.raw_frame = frame
+                if size:
+                    start = metrics.start()
+                    frame = cv2.resize(frame, size, dst=dst)
+                    metrics.observe("resize", start)
+            elif not self.live and not getattr(self.video_capture, "interrupted", False):
+                self.eof = True
+        self.touch()
+        return success, frame, timestamp, index
+
+    def process_frame(self, frame, timestamp=None, scale=1.0, draw=True, index=None):
+        # Pose + rep logic for one BGR frame, annotations are drawn onto frame in place unless draw=False.
+        # scale < 1 runs the model on a smaller copy, landmarks are normalised so drawing is unaffected.
+        # Frames of a cached clip take their landmarks from the cache instead, by the index read() gave them, so
+        # frames a stopped pipeline read but never processed don't shift the ones after them.
+        # Same lock as close() so the pose is never handed back to the pool while a frame is still in it,
+        # and so frames POSTed concurrently by one browser update the tracker one at a time.
+        # Preprocessing is inside it too because it fills this session's scratch buffers.
+        with self.pose_lock:
+            if self.closed:
+                return None
+            rgb_frame = None
+            replaying = self.replay is not None and index is not None
+            still = not replaying and self.motion_gate is not None and self.motion_gate.still(frame)
+            if not replaying and not still:
+                start = metrics.start()
+                rgb_frame = self._preprocess(frame, scale)
+                metrics.observe("preprocess", start)
+            if self.multi:
+                start = metrics.start()
+                result = self.tracker.process(rgb_frame, frame if draw else None, timestamp)
+                metrics.observe("inference", start)
+            elif still:
+                result = PoseResult(self.motion_gate.points)
+                metrics.count("motion_gated_frames")
+            elif replaying:
+                result = PoseResult(self.replay[index] if index < len(self.replay) else None)
+            else:
+                start = metrics.start()
+                result = self.tracker.pose.process(rgb_frame)
+                metrics.observe("inference", start)
+                if self.motion_gate:
+                    self.motion_gate.update(landmarks_to_array(result.pose_landmarks.landmark) if result.pose_landmarks else None)
+            if self.recorder is not None:
+                self.recorder.add(landmarks_to_array(result.pose_landmarks.landmark) if result.pose_landmarks else None, timestamp)
+            angles = None
+            if result.pose_landmarks and not self.multi:
+                landmarks = result.pose_landmarks.landmark
+                start = metrics.start()
+                angles, keypoints = self.tracker.get_angles_from_landmarks(landmarks, timestamp)
+                metrics.observe("angles", start)
+                start = metrics.start()
+                self.tracker.count_reps(frame if draw else None, angles, result, landmarks, keypoints, timestamp)
+                # Drawing happens inside count_reps, so the annotated path gets its own stage
+                metrics.observe("count_reps_draw" if draw else "count_reps", start)
+            if self.archive_path:
+                self._archive_frame(result, angles, timestamp)
+        if metrics.enabled:
+            self.fps.tick()
+            metrics.count("frames")
+        self.touch()
+        return result
+
+    def _preprocess(self, frame, scale):
+        # BGR frame -> RGB model input (optionally downscaled) in reused arrays
+        if scale < 1.0:
+            height, width = frame.shape[:2]
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            frame = cv2.resize(frame, size, dst=self.buffers.get("small", (size[1], size[0], 3)), interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=self.buffers.get("rgb", frame.shape))
+
+    def _archive_frame(self, result, angles, timestamp):
+        tracker = self.tracker
+        if self.archive is None:
+            self.archive = ArchiveWriter(self.archive_path, {
+                "session": self.session_id, "exercise": tracker.exercise_type, "states": tracker.rules.state_names,
+                "source": "live" if self.live else "file"})
+        points = landmarks_to_array(result.pose_landmarks.landmark) if result.pose_landmarks else None
+        self.archive.append(timestamp, points, None if angles is None else angles.values,
+                            tracker.exercise_state, tracker.posture_ok, tracker.rep_count)
+
+    def finish_clip(self):
+        # Called once a pipeline has drained; only a complete, in-order pass over the file is worth caching
+        with self.pose_lock:
+            recorder, self.recorder = self.recorder, None
+            complete = recorder is not None and self.eof and len(recorder) == self.frames_read > 0
+        key = self.cache_key() if callable(self.cache_key) else self.cache_key
+        if complete and key:
+            self.pose_cache.put(key, recorder.points, recorder.timestamps)
+
+    def frame_state(self, result, timestamp=None):
+        # JSON-friendly landmarks + rep state so a client can draw the overlay itself
+        state = self.tracker.status()
+        state["timestamp"] = timestamp
+        if self.multi:
+            return state  # landmarks are per person in state["people"]
+        state["landmarks"] = landmarks_to_array(result.pose_landmarks.landmark).round(4).tolist() if result.pose_landmarks else None
+        return state
+
+    def packed_state(self, result, timestamp):
+        points = landmarks_to_array(result.pose_landmarks.landmark) if result.pose_landmarks else None
+        return pack_landmarks(points, timestamp or 0.0, self.tracker.rep_count, self.tracker.posture_ok)
+
+    def close(self):
+        with self.hub_lock:
+            hub = self.hub
+        if hub:
+            hub.close()
+        self._interrupt_capture()
+        with self.capture_lock, self.pose_lock:
+            if self.closed:
+                return
+            self.closed = True
+            if self.video_capture:
+                self.video_capture.release()
+                self.video_capture = None
+            if self.multi:
+                self.tracker.close()
+            elif self.pose_pool:
+                self.pose_pool.release(self.tracker.pose)
+            if self.archive:
+                self.archive.close()
+
+
+class SessionRegistry:
+    def __init__(self, max_sessions=32, idle_timeout=300, pose_pool=None, pose_cache=None, archive_dir=None,
+                 archive_max_bytes=None, multi_pose_model=None, motion_gate=False):
+        self.max_sessions = max_sessions
+        self.motion_gate = motion_gate
+        self.multi_pose_model = multi_pose_model  # pose_landmarker .task bundle, enables create(..., people=N)
+        self.pose_pool = pose_pool
+        self.pose_cache = pose_cache
+        self.archive_dir = archive_dir
+        self.archive_max_bytes = archive_max_bytes  # oldest archives are removed as new sessions start, None keeps all
+        self.idle_timeout = idle_timeout
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.reaper = None
+
+    def create(self, session_id, exercise_id, people=1):
+        # A session restarting an exercise replaces its own pipeline instead of taking a new slot.
+        # people > 1 tracks up to that many bodies from one camera (see multi_person.py).
+        # Everything is checked and the new tracker built before the running pipeline is touched, so a bad request
+        # or a full pool leaves the session as it was.
+        if not 0 <= exercise_id < len(EXERCISES):
+            raise ValueError(f"Unknown exercise {exercise_id}")
+        if people < 1:
+            raise ValueError(f"people must be at least 1, got {people}")
+        if people > 1 and not self.multi_pose_model:
+            raise ValueError("Multi-person tracking needs a pose landmarker model (POSE_LANDMARKER_MODEL)")
+        self.evict_idle()
+        with self.lock:
+            replacing = self.sessions.get(session_id) is not None
+            if not replacing:
+                if len(self.sessions) >= self.max_sessions:
+                    raise SessionLimitReached(f"Maximum of {self.max_sessions} sessions reached")
+                # Hold the slot while the pose is checked out so two racing requests can't both squeeze past the cap
+                self.sessions[session_id] = None
+        try:
+            if people > 1:
+                from multi_person import MultiPersonTracker, MultiPoseDetector
+                tracker = MultiPersonTracker(exercise_id, MultiPoseDetector(self.multi_pose_model, num_poses=people))
+            else:
+                tracker = ExerciseTracker(exercise_id=exercise_id, pose=self._acquire_pose(session_id, replacing))
+        except Exception:
+            with self.lock:
+                if self.sessions.get(session_id, 0) is None:
+                    del self.sessions[session_id]
+            raise
+        archive_path = None
+        if self.archive_dir and people == 1:
+            # Time first so a directory listing is in session order
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}-{session_id[:8]}-{exercise_id}{ARCHIVE_EXTENSION}"
+            archive_path = os.path.join(self.archive_dir, name)
+            if self.archive_max_bytes:
+                with self.lock:
+                    writing = {p.archive_path for p in self.sessions.values() if p and p.archive_path}
+                evict_archives(self.archive_dir, self.archive_max_bytes, writing)
+        # Pose cache, archive and motion gating all assume a single body
+        single = people == 1
+        pipeline = SessionPipeline(session_id, tracker, self.pose_pool, self.pose_cache if single else None, archive_path,
+                                   self.motion_gate and single)
+        with self.lock:
+            previous = self.sessions.get(session_id)
+            self.sessions[session_id] = pipeline
+        if previous:
+            previous.close()
+        return pipeline
+
+    def _acquire_pose(self, session_id, replacing):
+        if not self.pose_pool:
+            return None
+        if not replacing:
+            return self.pose_pool.acquire()
+        try:
+            return self.pose_pool.acquire(timeout=0)
+        except PoolExhausted:
+            # Every graph is out, one of them is this session's own: hand it back and wait for one
+            self.remove(session_id)
+            with self.lock:
+                self.sessions.setdefault(session_id, None)
+            return self.pose_pool.acquire()
+
+    def get(self, session_id):
+        with self.lock:
+            pipeline = self.sessions.get(session_id)
+        if pipeline:
+            pipeline.touch()
+        return pipeline
+
+    def remove(self, session_id):
+        with self.lock:
+            pipeline = self.sessions.pop(session_id, None)
+        if pipeline:
+            pipeline.close()
+        return pipeline
+
+    def evict_idle(self):
+        now = time.time()
+        with self.lock:
+            idle = [sid for sid, p in self.sessions.items() if p and now - p.last_seen > self.idle_timeout]
+            evicted = [self.sessions.pop(sid) for sid in idle]
+        for pipeline in evicted:
+            pipeline.close()
+        return len(evicted)
+
+    def active_count(self):
+        with self.lock:
+            return len(self.sessions)
+
+    def active(self):
+        with self.lock:
+            return [p for p in self.sessions.values() if p]
+
+    def start_reaper(self, interval=30):
+        # Background sweep so abandoned tabs release their camera even if nobody else starts a session
+        if self.reaper:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                self.evict_idle()
+
+        self.reaper = threading.Thread(target=run, daemon=True)
+        self.reaper.start()
+
+    def close_all(self):
+        with self.lock:
+            pipelines = [p for p in self.sessions.values() if p]
+            self.sessions.clear()
+        for pipeline in pipelines:
+            pipeline.close()
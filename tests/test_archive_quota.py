@@ -0,0 +1,32 @@
+import os
+
+import numpy as np
+
+from archive import ArchiveWriter, evict_archives, iter_archives
+
+
+def _archive(directory, name, frames, mtime):
+    path = os.path.join(directory, name + ".ptla")
+    writer = ArchiveWriter(path, {"session": name, "states": ["Up", "Down"]})
+    for i in range(frames):
+        writer.append(i / 30, np.zeros((33, 4), np.float32), None, "Up", True, 0)
+    writer.close()
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_oldest_archives_go_first(tmp_path):
+    paths = [_archive(tmp_path, f"s{i}", 100, 1000 + i) for i in range(4)]
+    evict_archives(tmp_path, os.path.getsize(paths[2]) + os.path.getsize(paths[3]))
+    assert [os.path.exists(p) for p in paths] == [False, False, True, True]
+    assert [header["session"] for _, header, _ in iter_archives(tmp_path)] == ["s2", "s3"]
+
+
+def test_archives_still_being_written_stay(tmp_path):
+    paths = [_archive(tmp_path, f"s{i}", 100, 1000 + i) for i in range(3)]
+    evict_archives(tmp_path, os.path.getsize(paths[0]), keep={paths[0]})
+    assert [os.path.exists(p) for p in paths] == [True, False, False]
+
+
+def test_missing_directory_is_fine(tmp_path):
+    evict_archives(tmp_path / "none", 0)
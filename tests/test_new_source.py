@@ -0,0 +1,48 @@
+import cv2
+import numpy as np
+
+from bench import synthetic_fixture
+from mvp import ExerciseTracker
+from sessions import SessionPipeline
+
+WALL_CLOCK = 1.76e9
+
+
+def _tracker():
+    return ExerciseTracker(0, pose=object())  # replay never calls the pose model
+
+
+def _clip_reps():
+    fixture = synthetic_fixture(0, frames=600)
+    return fixture, _tracker().replay_landmarks(fixture["points"], fixture["timestamps"])
+
+
+def test_second_clip_counts_its_reps():
+    fixture, reps = _clip_reps()
+    assert reps > 0
+    tracker = _tracker()
+    tracker.replay_landmarks(fixture["points"], fixture["timestamps"])
+    tracker.new_source()
+    assert tracker.replay_landmarks(fixture["points"], fixture["timestamps"]) == 2 * reps
+    assert np.isclose(tracker.exercise_duration, 2 * fixture["timestamps"][-1])
+
+
+def test_clip_after_webcam_counts_reps_and_duration():
+    fixture, reps = _clip_reps()
+    tracker = _tracker()
+    tracker.replay_landmarks(fixture["points"], fixture["timestamps"] + WALL_CLOCK)  # live frames use time.time()
+    tracker.new_source()
+    assert tracker.replay_landmarks(fixture["points"], fixture["timestamps"]) == 2 * reps
+    assert np.isclose(tracker.exercise_duration, 2 * fixture["timestamps"][-1], atol=0.01)  # float32 wall clock
+    assert tracker.calories_burned > 0
+
+
+def test_open_capture_starts_the_tracker_over():
+    fixture, reps = _clip_reps()
+    tracker = _tracker()
+    pipeline = SessionPipeline("session", tracker)
+    for _ in range(2):
+        pipeline.open_capture(cv2.VideoCapture())
+        tracker.replay_landmarks(fixture["points"], fixture["timestamps"])
+    assert tracker.rep_count == 2 * reps
+    assert np.isclose(tracker.duration_offset, fixture["timestamps"][-1])
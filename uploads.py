@@ -0,0 +1,305 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+import weakref
+
+import cv2
+from werkzeug.utils import secure_filename
+
+VIDEO_EXTENSIONS = {".mp4", ".m4v", ".mov", ".avi", ".mkv", ".webm"}
+
+
+def parse_size(value):
+    # Declared upload size from a JSON body or form field: None when it wasn't sent, ValueError unless it's a
+    # whole number of bytes (bools and floats included, JSON true is not a size)
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, str)) or not str(value).strip().isdigit():
+        raise ValueError("Upload size must be a whole number of bytes")
+    return int(value)
+
+
+class UploadQuotaExceeded(Exception):
+    pass
+
+
+class UploadOffsetMismatch(Exception):
+    # A chunk didn't start where the previous one ended, the client should resume from expected
+    def __init__(self, expected):
+        super().__init__(f"Upload is at byte {expected}")
+        self.expected = expected
+
+
+class Upload:
+    # One video being received. Chunks are appended strictly in order so the content hash (the pose cache key)
+    # is computed as the bytes arrive instead of re-reading the file afterwards.
+    def __init__(self, upload_id, path, size, filename, owner=None, limit=None):
+        self.upload_id = upload_id
+        self.path = path
+        self.size = size            # declared total, None when unknown (plain form uploads)
+        self.filename = filename    # sanitised client name, for display only
+        self.owner = owner
+        self.limit = limit          # most bytes accepted when no size was declared
+        self.reserve = None         # without a declared size, UploadStore charges each block before it's written
+        self.reserved = 0           # bytes of the block being written, counted by the store until it's on disk
+        self.received = 0
+        self.complete = False
+        self.cancelled = False
+        self.digest = hashlib.sha256()
+        self.updated = time.time()
+        self.cond = threading.Condition()
+        self.write_lock = threading.Lock()  # one chunk at a time, readers only wait on cond
+
+    def write(self, stream, offset, chunk_size=1024 * 1024):
+        # Streams one chunk from a file-like object to disk in chunk_size blocks, returns the new offset
+        with self.write_lock:
+            if self.complete or self.cancelled or offset != self.received:
+                raise UploadOffsetMismatch(self.received)
+            with open(self.path, "ab") as f:
+                for block in iter(lambda: stream.read(chunk_size), b""):
+                    if self.size is not None and self.received + len(block) > self.size:
+                        raise ValueError("Upload is larger than its declared size")
+                    if self.limit is not None and self.received + len(block) > self.limit:
+                        raise UploadQuotaExceeded(f"Uploads are limited to {self.limit // (1024 * 1024)} MB")
+                    if self.reserve:
+                        self.reserve(self, len(block))
+                    try:
+                        f.write(block)
+                        f.flush()
+                    finally:
+                        self.reserved = 0
+                    self.digest.update(block)
+                    with self.cond:
+                        self.received += len(block)
+                        self.updated = time.time()
+                        self.cond.notify_all()  # a capture waiting on this upload can read further
+            if self.size is not None and self.received == self.size:
+                self.finish()
+            return self.received
+
+    def finish(self):
+        with self.cond:
+            self.complete = True
+            self.size = self.received
+            self.cond.notify_all()
+
+    def cancel(self):
+        with self.cond:
+            self.cancelled = True
+            self.cond.notify_all()
+
+    def wait(self, received, timeout):
+        # Blocks until more than received bytes are in (or the upload ends), False on timeout
+        with self.cond:
+            return self.cond.wait_for(lambda: self.received > received or self.complete or self.cancelled, timeout)
+
+    def cache_key(self, variant=""):
+        # Same key PoseCache.key_for_file gives the finished file, None until then
+        if not self.complete or self.cancelled:
+            return None
+        return self.digest.hexdigest() + ("-" + variant if variant else "")
+
+    def status(self):
+        return {"upload_id": self.upload_id, "filename": self.filename, "offset": self.received,
+                "size": self.size, "complete": self.complete}
+
+
+class UploadStore:
+    # Uploaded videos under unique generated names (never the client's filename), within a byte quota:
+    # creating an upload first drops abandoned partial uploads, then the oldest finished ones until it fits.
+    def __init__(self, directory, max_bytes=2 * 1024 ** 3, stale_after=3600, chunk_size=1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stale_after = stale_after  # seconds without a chunk before a partial upload is discarded
+        self.chunk_size = chunk_size
+        self.uploads = {}
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def create(self, filename, size=None, owner=None):
+        name = secure_filename(filename or "")
+        extension = os.path.splitext(name)[1].lower()
+        if extension not in VIDEO_EXTENSIONS:
+            raise ValueError(f"Unsupported video type {extension or '(none)'}")
+        if size is not None and size <= 0:
+            raise ValueError("Upload size must be more than 0 bytes")
+        if size is not None and size > self.max_bytes:
+            raise UploadQuotaExceeded(f"Uploads are limited to {self.max_bytes // (1024 * 1024)} MB")
+        upload_id = uuid.uuid4().hex
+        upload = Upload(upload_id, os.path.join(self.directory, upload_id + extension), size, name, owner,
+                        limit=None if size else self.max_bytes)
+        if size is None:
+            upload.reserve = self._reserve
+        with self.lock:
+            self._evict(size or 0)
+            self.uploads[upload_id] = upload
+        open(upload.path, "wb").close()
+        return upload
+
+    def get(self, upload_id, owner=None):
+        with self.lock:
+            upload = self.uploads.get(upload_id)
+        if upload is None or (owner is not None and upload.owner != owner):
+            return None
+        return upload
+
+    def save(self, filename, stream, owner=None):
+        # Whole file in one go (the plain form upload), still streamed to disk in blocks
+        upload = self.create(filename, owner=owner)
+        try:
+            upload.write(stream, 0, self.chunk_size)
+        except Exception:
+            self.discard(upload)
+            raise
+        upload.finish()
+        return upload
+
+    def write(self, upload, stream, offset):
+        return upload.write(stream, offset, self.chunk_size)
+
+    def discard(self, upload):
+        with self.lock:
+            self.uploads.pop(upload.upload_id, None)
+        upload.cancel()  # wakes any capture still waiting on it
+        try:
+            os.remove(upload.path)
+        except FileNotFoundError:
+            pass
+
+    def _reserve(self, upload, nbytes):
+        # Nothing was set aside for an upload of unknown size, so it's charged a block at a time as it arrives and
+        # concurrent ones can't each pass the quota check and overrun it together
+        with self.lock:
+            self._evict(nbytes)
+            upload.reserved = nbytes
+
+    def _evict(self, incoming):
+        # Caller holds self.lock
+        now = time.time()
+        for upload in list(self.uploads.values()):
+            if not upload.complete and now - upload.updated > self.stale_after:
+                self.uploads.pop(upload.upload_id)
+                upload.cancel()
+                self._remove(upload.path)
+        partial = {u.path for u in self.uploads.values() if not u.complete}
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file():
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files) + sum(u.size - u.received if u.size else u.reserved
+                                                        for u in self.uploads.values() if not u.complete)
+        for _, size, path in sorted(files):
+            if total + incoming <= self.max_bytes:
+                break
+            if path in partial:
+                continue  # still being received
+            self._remove(path)
+            total -= size
+        if total + incoming > self.max_bytes:
+            raise UploadQuotaExceeded("Upload storage is full, please try again later")
+        for upload_id in [i for i, u in self.uploads.items() if u.complete and not os.path.exists(u.path)]:
+            del self.uploads[upload_id]
+
+    @staticmethod
+    def _remove(path):
+        # Open captures keep reading a removed file on POSIX, so eviction never breaks a running session
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class UploadCapture:
+    # cv2.VideoCapture over a file that is still being uploaded. Reads whatever frames have arrived; when it runs
+    # out before the upload is complete it waits for the next chunk and reopens at the frame it got to, so
+    # streamable containers (WebM, AVI, fragmented or fast-start MP4) start processing after the first chunk.
+    # Files with their index at the end (plain MP4/MOV) can't be opened until the last chunk is in.
+    def __init__(self, upload, poll=0.25, stall_timeout=120):
+        self.upload = upload
+        self.poll = poll
+        self.stall_timeout = stall_timeout  # seconds without new data before the stream is given up on
+        self.capture = None
+        self.opened_at = -1  # bytes received when the current capture was opened
+        self.position = 0    # frames delivered so far
+        self.held = None     # last frame read from a partial file, not delivered until the next one turns up
+        self.held_msec = 0.0
+        self.msec = 0.0      # timestamp of the frame delivered last, the capture itself is a frame ahead of it
+        self.stopped = False
+        self.interrupts = weakref.WeakSet()  # threads whose current or next read() should give up, see interrupt()
+        self.interrupted = False  # the last read() gave up because of interrupt(), not because the file ended
+
+    def _open(self):
+        if self.capture is not None:
+            self.capture.release()
+        self.held = None  # read again from the reopened file, complete by then
+        self.opened_at = self.upload.received
+        self.capture = cv2.VideoCapture(self.upload.path)
+        if self.position and self.capture.isOpened():
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, self.position)
+
+    def read(self, image=None):
+        waited = 0.0
+        self.interrupted = False
+        while not self.stopped and not self.upload.cancelled:
+            if threading.current_thread() in self.interrupts:
+                self.interrupts.discard(threading.current_thread())
+                self.interrupted = True
+                break
+            whole = self.upload.complete and self.opened_at == self.upload.received
+            if self.capture is not None and self.capture.isOpened():
+                success, frame = self.capture.read(image if whole else None)
+                msec = self.capture.get(cv2.CAP_PROP_POS_MSEC) if success else 0.0
+                if success and not whole:
+                    # The newest frame of a partial file may be cut short and still decode (damaged), so a frame
+                    # is only delivered once the one after it has decoded too
+                    held, self.held = self.held, frame
+                    msec, self.held_msec = self.held_msec, msec
+                    if held is None:
+                        continue
+                    frame = held
+                if success:
+                    self.msec = msec
+                    self.position += 1
+                    return True, frame
+            if self.upload.received > self.opened_at:
+                self._open()  # more has arrived since the last open, carry on from the same frame
+                continue
+            if self.upload.complete:
+                break  # really the end
+            if self.upload.wait(self.opened_at, self.poll):
+                waited = 0.0
+            else:
+                waited += self.poll
+                if waited >= self.stall_timeout:
+                    break
+        return False, None
+
+    def stop(self):
+        # Thread-safe, a read() waiting for data returns within poll seconds
+        self.stopped = True
+
+    def interrupt(self, thread):
+        # Same for just the read() thread is in, or its next one if it's between reads, other readers carry on
+        self.interrupts.add(thread)
+
+    def isOpened(self):
+        return not self.stopped
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return self.position
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return self.msec
+        return self.capture.get(prop) if self.capture is not None else 0.0
+
+    def set(self, prop, value):
+        return False
+
+    def release(self):
+        self.stop()
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None